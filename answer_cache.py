@@ -0,0 +1,191 @@
+"""
+Persistent semantic answer cache for WorldWhisperer.
+Questions are matched by the cosine similarity of their embeddings, so a
+rephrased repeat ("who is Kalinda" / "Who's Kalinda?") is answered from SQLite
+in milliseconds instead of paying for retrieval and an LLM completion. Each
+answer remembers the notes that supplied its context and is dropped when any
+of them changes.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class AnswerCache:
+    """SQLite cache of LLM answers with LRU and TTL eviction."""
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None,
+                 ttl_hours: Optional[float] = None, threshold: Optional[float] = None):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite file (defaults to answer_cache_path env var)
+            max_entries: Answers kept before LRU eviction (defaults to env var)
+            ttl_hours: Age after which an answer expires (defaults to env var)
+            threshold: Minimum cosine similarity for a hit (defaults to env var)
+        """
+        self.path = path or os.getenv('answer_cache_path', './answer_cache.db')
+        self.max_entries = max_entries or int(os.getenv('answer_cache_max_entries', '1000'))
+        self.ttl_seconds = (ttl_hours or float(os.getenv('answer_cache_ttl_hours', '168'))) * 3600
+        self.threshold = threshold or float(os.getenv('answer_cache_threshold', '0.95'))
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            ' id INTEGER PRIMARY KEY,'
+            ' context_key TEXT NOT NULL,'
+            ' query TEXT NOT NULL,'
+            ' embedding BLOB NOT NULL,'
+            ' answer TEXT NOT NULL,'
+            ' created REAL NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS answers_context_key ON answers (context_key)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS answer_notes ('
+            ' answer_id INTEGER NOT NULL REFERENCES answers (id) ON DELETE CASCADE,'
+            ' title TEXT NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS answer_notes_title ON answer_notes (title)')
+        self._conn.commit()
+
+    @staticmethod
+    def context_key(*parts) -> str:
+        """
+        Hash everything besides the question that shapes an answer.
+
+        Pass e.g. the embedding model, LLM model, system instruction and any
+        retrieval filter; answers are only reused under an identical key.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def lookup(self, embedding, context_key: str) -> Optional[Dict]:
+        """
+        Find a cached answer for a question.
+
+        Args:
+            embedding: Question embedding
+            context_key: Key from context_key()
+
+        Returns:
+            Dict with 'answer', 'query' (the cached question) and 'similarity',
+            or None on a miss
+        """
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) + 1e-12)
+        now = time.time()
+
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, query, embedding, answer FROM answers WHERE context_key = ? AND created > ?',
+                (context_key, now - self.ttl_seconds)
+            ).fetchall()
+            if not rows:
+                return None
+
+            # Stored embeddings are normalized, so one matrix-vector product gives every cosine similarity
+            matrix = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            similarities = matrix @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            answer_id, query, _, answer = rows[best]
+            self._conn.execute('UPDATE answers SET last_used = ? WHERE id = ?', (now, answer_id))
+            self._conn.commit()
+
+        return {'answer': answer, 'query': query, 'similarity': float(similarities[best])}
+
+    def put(self, query: str, embedding, context_key: str, answer: str, notes: List[str]):
+        """
+        Store an answer.
+
+        Args:
+            query: The question
+            embedding: Question embedding
+            context_key: Key from context_key()
+            answer: LLM answer
+            notes: Titles of the notes whose context the answer was built from
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-12)
+        now = time.time()
+
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO answers (context_key, query, embedding, answer, created, last_used)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (context_key, query, vector.tobytes(), answer, now, now)
+            )
+            self._conn.executemany(
+                'INSERT INTO answer_notes (answer_id, title) VALUES (?, ?)',
+                [(cursor.lastrowid, title) for title in set(notes)]
+            )
+
+            # Expired answers first, then least recently used ones over budget
+            self._conn.execute('DELETE FROM answers WHERE created <= ?', (now - self.ttl_seconds,))
+            excess = self._conn.execute('SELECT COUNT(*) FROM answers').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    'DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+            self._conn.commit()
+
+    def invalidate_notes(self, titles: List[str]) -> int:
+        """
+        Drop every answer built from any of the given notes.
+
+        Returns:
+            Number of answers removed
+        """
+        titles = list(titles)
+        removed = 0
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(titles), 500):
+                chunk = titles[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                removed += self._conn.execute(
+                    f'DELETE FROM answers WHERE id IN '
+                    f'(SELECT answer_id FROM answer_notes WHERE title IN ({placeholders}))',
+                    chunk
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def clear(self):
+        """Remove every cached answer."""
+        with self._lock:
+            self._conn.execute('DELETE FROM answers')
+            self._conn.commit()
+
+
+# Global cache instance (lazy-loaded)
+_global_cache: Optional[AnswerCache] = None
+
+
+def get_cache() -> Optional[AnswerCache]:
+    """
+    Get the global answer cache (creates if not exists).
+
+    Returns:
+        AnswerCache instance, or None if answer_cache is disabled
+    """
+    global _global_cache
+    if os.getenv('answer_cache', 'True') != 'True':
+        return None
+    if _global_cache is None:
+        _global_cache = AnswerCache()
+    return _global_cache
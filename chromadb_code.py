@@ -1,10 +1,24 @@
 import os
-import chromadb
-from chromadb.config import Settings
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from tqdm.auto import tqdm
-from sentence_transformers import SentenceTransformer
 from typing import List
 
+import answer_cache
+import embedding_cache
+import keyword_index
+import llm_code
+import pipeline
+import reranker
+import title_index
+import vector_store
+
+# chromadb, sentence_transformers and tiktoken are imported inside the functions
+# that need them, so importing this module is cheap and warm-up can run them
+# on a background thread.
+
 
 def remove_non_ascii(text):
     return ''.join(char for char in text if ord(char) < 128)
@@ -12,128 +26,1178 @@ def remove_non_ascii(text):
 
 # Initialize local embedding model (loaded once, reused across calls)
 _embedding_model = None
+_model_lock = threading.Lock()
 
-def get_embedding_model():
-    """Lazy-load the embedding model to avoid multiple initializations"""
+# Background warm-up state (see start_warmup)
+_warmup_future = None
+_warmup_seconds = None
+
+# Per-stage latency of the most recent get_chromadb_context() call, in milliseconds
+last_retrieval_timings = {}
+
+# Process-wide ChromaDB clients and vector stores, keyed by path / (backend, path, name)
+_clients = {}
+_collections = {}
+_registry_lock = threading.Lock()
+
+
+def get_client(chromadb_path=None):
+    """Get the shared PersistentClient for a ChromaDB path (created on first use)."""
+    chromadb_path = chromadb_path or os.getenv('chromadb_path', './chromadb')
+    with _registry_lock:
+        if chromadb_path not in _clients:
+            import chromadb
+
+            _clients[chromadb_path] = chromadb.PersistentClient(path=chromadb_path)
+        return _clients[chromadb_path]
+
+
+def get_collection(create=False, collection_name=None, chromadb_path=None):
+    """
+    Get the shared vector store for (path, collection name).
+
+    The backend is chosen by the vector_store env var: 'chroma' (default) or
+    'numpy' (vector_store.NumpyStore, kept in <chromadb_path>/<collection>_vectors/).
+    The store is opened once per process and reused by every query and
+    ingest. Call invalidate_collections() after the collection is rebuilt.
+
+    Args:
+        create: Create the collection if it doesn't exist yet
+        collection_name: Defaults to chromadb_collection_name env var
+        chromadb_path: Defaults to chromadb_path env var
+
+    Returns:
+        vector_store.VectorStore
+    """
+    collection_name = collection_name or os.getenv('chromadb_collection_name')
+    chromadb_path = chromadb_path or os.getenv('chromadb_path', './chromadb')
+    backend = vector_store.get_vector_store_backend()
+    key = (backend, chromadb_path, collection_name)
+
+    collection = _collections.get(key)
+    if collection is None:
+        if backend == 'numpy':
+            store_path = Path(chromadb_path) / f"{collection_name}_vectors"
+            if not create and not vector_store.NumpyStore.exists(store_path):
+                raise FileNotFoundError(f"No vector store at {store_path}. Run Update ChromaDB first.")
+            with _registry_lock:
+                collection = _collections.setdefault(key, vector_store.NumpyStore(store_path))
+            return collection
+
+        client = get_client(chromadb_path)
+        with _registry_lock:
+            if key not in _collections:
+                if create:
+                    chroma_collection = client.get_or_create_collection(
+                        name=collection_name,
+                        metadata={"hnsw:space": "cosine"}
+                    )
+                else:
+                    chroma_collection = client.get_collection(name=collection_name)
+                _collections[key] = vector_store.ChromaStore(client, chroma_collection)
+            collection = _collections[key]
+    return collection
+
+
+def store_exists(collection_name=None, chromadb_path=None):
+    """
+    True if a vector store has been written, checked without opening (or creating) it.
+
+    For ChromaDB this only checks for the database file, not the collection.
+    """
+    collection_name = collection_name or os.getenv('chromadb_collection_name')
+    chromadb_path = chromadb_path or os.getenv('chromadb_path', './chromadb')
+    if vector_store.get_vector_store_backend() == 'numpy':
+        return vector_store.NumpyStore.exists(Path(chromadb_path) / f"{collection_name}_vectors")
+    return (Path(chromadb_path) / 'chroma.sqlite3').exists()
+
+
+def reset_collection(collection_name=None, chromadb_path=None):
+    """
+    Delete a collection's vectors and its keyword and title indexes.
+
+    Used before re-indexing every note under new ingest settings (see
+    ingest_fingerprint()), e.g. after switching to a model with a different
+    embedding dimension, so old and new vectors are never mixed.
+    """
+    import shutil
+
+    collection_name = collection_name or os.getenv('chromadb_collection_name')
+    chromadb_path = chromadb_path or os.getenv('chromadb_path', './chromadb')
+    invalidate_collections()
+    if vector_store.get_vector_store_backend() == 'numpy':
+        shutil.rmtree(Path(chromadb_path) / f"{collection_name}_vectors", ignore_errors=True)
+    elif store_exists(collection_name, chromadb_path):
+        client = get_client(chromadb_path)
+        if collection_name in [c if isinstance(c, str) else c.name for c in client.list_collections()]:
+            client.delete_collection(name=collection_name)
+    keyword_index.reset_index(collection_name, chromadb_path)
+    title_index.reset_index(collection_name, chromadb_path)
+
+
+def invalidate_collections():
+    """Drop cached collection handles so the next call reopens them (e.g. after a re-index)."""
+    with _registry_lock:
+        _collections.clear()
+
+
+EMBED_BACKENDS = ('torch', 'onnx', 'int8')
+
+
+def get_embed_backend():
+    """Embedding backend selected by the embed_backend env var."""
+    backend = os.getenv('embed_backend', 'torch').lower()
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embed_backend '{backend}'. Choose one of: {', '.join(EMBED_BACKENDS)}")
+    return backend
+
+
+# Bump when the stored metadata, document or keyword-index layout changes, so existing collections are rebuilt
+INDEX_SCHEMA_VERSION = 4
+
+
+def ingest_fingerprint():
+    """
+    Settings that determine how notes are embedded and stored.
+
+    Saved in the ingest manifest; when it no longer matches, every note is
+    re-indexed into a fresh collection instead of only the changed ones.
+    """
+    return {
+        'schema': INDEX_SCHEMA_VERSION,
+        'embedding_model': embedding_model_key(),
+        'chunk_tokens': os.getenv('chunk_tokens', 'auto'),
+        'chunk_overlap': os.getenv('chunk_overlap', '32'),
+        'vector_store': vector_store.get_vector_store_backend(),
+    }
+
+
+def embedding_model_key():
+    """
+    Identifier for the model + backend producing the vectors.
+
+    Used as the embedding cache key, so vectors from different backends are
+    never mixed.
+    """
+    model_name = os.getenv('local_embed_model', 'all-MiniLM-L6-v2')
+    backend = get_embed_backend()
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+
+def build_embedding_model(backend=None):
+    """
+    Construct a SentenceTransformer for the given backend.
+
+    Backends:
+        torch: Full-precision PyTorch model (default)
+        onnx: ONNX Runtime (needs optimum[onnxruntime]); embed_onnx_file picks a
+            specific export, e.g. a quantized onnx/model_qint8_avx512_vnni.onnx
+        int8: PyTorch with dynamic int8 quantization of the Linear layers
+
+    Every backend exposes the same encode() contract, so create_embeddings()
+    works unchanged.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or get_embed_backend()
+    model_name = os.getenv('local_embed_model', 'all-MiniLM-L6-v2')
+
+    if backend == 'onnx':
+        onnx_file = os.getenv('embed_onnx_file')
+        model_kwargs = {'file_name': onnx_file} if onnx_file else None
+        return SentenceTransformer(model_name, backend='onnx', model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(model_name, device='cpu' if backend == 'int8' else None)
+    if backend == 'int8':
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def _load_embedding_model(verbose=True):
+    """Load the embedding model once, even if called from several threads."""
     global _embedding_model
-    if _embedding_model is None:
-        model_name = os.getenv('local_embed_model', 'all-MiniLM-L6-v2')
-        print(f"Loading local embedding model: {model_name}")
-        _embedding_model = SentenceTransformer(model_name)
+    with _model_lock:
+        if _embedding_model is None:
+            if verbose:
+                print(f"Loading local embedding model: {embedding_model_key()}")
+            _embedding_model = build_embedding_model()
     return _embedding_model
 
 
-def create_embeddings(texts: List[str]) -> List[List[float]]:
-    """Create embeddings using local sentence-transformers model"""
+def get_embedding_model():
+    """Lazy-load the embedding model to avoid multiple initializations"""
+    if _warmup_future is not None:
+        # Wait for the background warm-up instead of loading a second copy
+        try:
+            _warmup_future.result()
+        except Exception:
+            pass  # Fall through and load (or report the error) in the foreground
+    return _load_embedding_model()
+
+
+def _warm_up():
+    """Load the models, run one dummy encode and open the collection."""
+    global _warmup_seconds
+    start = time.perf_counter()
+
+    model = _load_embedding_model(verbose=False)
+    model.encode(["warm-up"], show_progress_bar=False)
+    reranker.get_reranker(verbose=False)
+    # Opening a PersistentClient creates chroma.sqlite3, which would make an
+    # uninitialized store look initialized, so only open one that exists
+    if store_exists():
+        try:
+            get_collection()
+        except Exception:
+            pass  # Collection doesn't exist yet; it will be created on first ingest
+
+    _warmup_seconds = time.perf_counter() - start
+
+
+def start_warmup():
+    """
+    Start warming up the embedding model and ChromaDB on a background thread.
+
+    Query code waits on the returned future instead of loading the model
+    itself, so the first question doesn't stall while weights load.
+
+    Returns:
+        concurrent.futures.Future that completes when warm-up is done
+    """
+    global _warmup_future
+    if _warmup_future is None:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warmup')
+        _warmup_future = executor.submit(_warm_up)
+        executor.shutdown(wait=False)
+    return _warmup_future
+
+
+def get_warmup_status():
+    """Human-readable warm-up status for the settings screen."""
+    if _warmup_future is None:
+        return "not started"
+    if not _warmup_future.done():
+        return "in progress"
+    if _warmup_future.exception() is not None:
+        return f"failed ({_warmup_future.exception()})"
+    return f"ready in {_warmup_seconds:.1f}s"
+
+
+def create_embeddings(texts: List[str], batch_size: int = 32) -> List[List[float]]:
+    """
+    Create embeddings using local sentence-transformers model.
+
+    Vectors are looked up in the on-disk embedding cache first, so only texts
+    that haven't been embedded with this model before are encoded.
+    """
+    cache = embedding_cache.get_cache()
+    if cache is None:
+        model = get_embedding_model()
+        embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+        return embeddings.tolist()
+
+    model_name = embedding_model_key()
+    vectors = cache.get_many(model_name, texts)
+
+    missing = [i for i in range(len(texts)) if i not in vectors]
+    if missing:
+        model = get_embedding_model()
+        missing_texts = [texts[i] for i in missing]
+        embeddings = model.encode(missing_texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+        cache.put_many(model_name, missing_texts, embeddings)
+        vectors.update(zip(missing, embeddings))
+
+    return [vectors[i].tolist() for i in range(len(texts))]
+
+
+def _init_embed_worker(threads):
+    """Process-pool initializer: pin torch threads and load this worker's model copy."""
+    import torch
+
+    torch.set_num_threads(threads)
+    _load_embedding_model(verbose=False)
+
+
+def _encode_in_worker(texts):
+    """Encode one batch inside a worker process."""
+    model = _load_embedding_model(verbose=False)
+    return model.encode(texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True)
+
+
+def embed_batches_multiprocess(document_batches, workers, threads=None):
+    """
+    Embed document batches across a pool of worker processes.
+
+    Each worker loads its own copy of the model and uses embed_worker_threads
+    torch threads. The first batch is encoded in this process, and encoding its
+    cache misses is timed as the single-process baseline; the speedup of the
+    pool over it is printed once every batch is done (skipped if either side
+    had nothing to encode). The embedding cache is consulted here, so workers
+    only receive texts that still need encoding.
+
+    Args:
+        document_batches: List of lists of document strings
+        workers: Number of worker processes
+        threads: Torch threads per worker (defaults to embed_worker_threads env var)
+
+    Yields:
+        List of embeddings for each batch, in input order
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    threads = threads or int(os.getenv('embed_worker_threads', '1'))
+    cache = embedding_cache.get_cache()
+    model_name = embedding_model_key()
+
+    def cached(documents):
+        """Split a batch into cached vectors and the indices still to encode."""
+        vectors = cache.get_many(model_name, documents) if cache else {}
+        return vectors, [i for i in range(len(documents)) if i not in vectors]
+
+    # Baseline: first batch in this process. Only encoding cache misses is timed,
+    # so a mostly cached first batch doesn't inflate the single-process rate
+    single_chars_per_second = None
+    vectors, missing = cached(document_batches[0])
+    if missing:
+        model = get_embedding_model()
+        missing_texts = [document_batches[0][i] for i in missing]
+        start = time.perf_counter()
+        embeddings = model.encode(missing_texts, batch_size=len(missing_texts), show_progress_bar=False,
+                                  convert_to_numpy=True)
+        single_chars_per_second = sum(map(len, missing_texts)) / max(time.perf_counter() - start, 1e-9)
+        if cache:
+            cache.put_many(model_name, missing_texts, embeddings)
+        vectors.update(zip(missing, embeddings))
+    yield [vectors[i].tolist() for i in range(len(document_batches[0]))]
+
+    # spawn, not fork: forking a process that already holds torch threads can deadlock
+    start = time.perf_counter()
+    encoded_chars = 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_embed_worker, initargs=(threads,)) as executor:
+        pending = []
+        for documents in document_batches[1:]:
+            vectors, missing = cached(documents)
+            future = executor.submit(_encode_in_worker, [documents[i] for i in missing]) if missing else None
+            pending.append((documents, vectors, missing, future))
+
+        for documents, vectors, missing, future in pending:
+            if future is not None:
+                missing_texts = [documents[i] for i in missing]
+                embeddings = future.result()
+                if cache:
+                    cache.put_many(model_name, missing_texts, embeddings)
+                vectors.update(zip(missing, embeddings))
+                encoded_chars += sum(map(len, missing_texts))
+            yield [vectors[i].tolist() for i in range(len(documents))]
+
+    pool_chars_per_second = encoded_chars / max(time.perf_counter() - start, 1e-9)
+    if encoded_chars and single_chars_per_second:
+        print(f"Multi-process embedding ({workers} workers x {threads} threads): "
+              f"{pool_chars_per_second / single_chars_per_second:.2f}x the single-process rate")
+
+
+# Metadata keys written by prepare_batch() / prepare_frame(); frontmatter fields are stored as fm_<key>
+NOTE_METADATA_KEYS = ('title', 'text', 'tags', 'category', 'parent', 'chunk', 'start')
+
+
+def flatten_frontmatter(frontmatter):
+    """
+    Turn parsed frontmatter into ChromaDB metadata fields.
+
+    ChromaDB metadata values must be scalars, so each field is stored as
+    'fm_<key>' and lists are joined with '|'.
+    """
+    return {
+        f"fm_{key}": "|".join(map(str, value)) if isinstance(value, list) else value
+        for key, value in (frontmatter or {}).items()
+    }
+
+
+def format_document(meta):
+    """Build the document string that gets embedded for a note."""
+    return f"NAME: {meta['title']}\nENTRY: {meta['text']}\nTAGS: {meta['tags']}"
+
+
+def count_model_tokens(text):
+    """Number of embedding-model tokens in text, without special tokens."""
+    tokenizer = get_embedding_model().tokenizer
+    return len(tokenizer(text, add_special_tokens=False, verbose=False)['input_ids'])
+
+
+def chunk_budget(title, tags):
+    """
+    Embedding-model tokens left for a chunk's text in its document.
+
+    The embedding model truncates documents past its max_seq_length, cutting
+    off the end of the entry and the TAGS line, so the budget is what remains
+    after the NAME/ENTRY header, the TAGS line and the special tokens.
+    chunk_tokens caps it lower ("auto", the default, uses the whole budget;
+    0 disables chunking).
+
+    Returns:
+        Maximum model tokens per chunk, or 0 if chunking is disabled
+    """
+    setting = os.getenv('chunk_tokens', 'auto')
+    if setting != 'auto' and int(setting) <= 0:
+        return 0
+
     model = get_embedding_model()
-    embeddings = model.encode(texts, show_progress_bar=False, convert_to_numpy=True)
-    return embeddings.tolist()
+    frame = format_document({'title': title, 'text': '', 'tags': tags})
+    budget = model.max_seq_length - model.tokenizer.num_special_tokens_to_add() - count_model_tokens(frame)
+    # A very long tag line can't be helped; keep chunks usefully large and let its end truncate
+    budget = max(budget, 32)
+    return budget if setting == 'auto' else min(budget, int(setting))
+
+
+def chunk_text(text, chunk_tokens, overlap):
+    """
+    Split text into overlapping passages of at most chunk_tokens embedding-model tokens.
+
+    Chunks are cut from the original text at token boundaries (via the
+    tokenizer's character offsets), so casing and spacing are preserved.
+
+    Args:
+        text: Note text
+        chunk_tokens: Maximum tokens per chunk (0 disables chunking)
+        overlap: Tokens shared between consecutive chunks, capped at half of
+            chunk_tokens so each chunk advances by at least half a chunk
+
+    Returns:
+        List of (start, chunk) tuples, where start is the chunk's character
+        offset in text (just [(0, text)] if it fits in one chunk)
+    """
+    if chunk_tokens <= 0:
+        return [(0, text)]
+
+    tokenizer = get_embedding_model().tokenizer
+    spans = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)['offset_mapping']
+    if len(spans) <= chunk_tokens:
+        return [(0, text)]
+
+    step = chunk_tokens - min(max(overlap, 0), chunk_tokens // 2)
+    chunks = []
+    for start in range(0, len(spans), step):
+        end = min(start + chunk_tokens, len(spans))
+        chunks.append((spans[start][0], text[spans[start][0]:spans[end - 1][1]]))
+        if end >= len(spans):
+            break
+    return chunks
+
+
+def prepare_batch(meta_batch_list):
+    """
+    Expand notes into the chunk entries stored in ChromaDB.
+
+    Each chunk keeps the note's title, tags, category and frontmatter fields
+    and links back to it through the 'parent' and 'chunk' metadata fields;
+    'start' is the chunk's character offset in the note text.
+    Notes that fit in one chunk keep their plain title as ID; longer notes get
+    'title#0', 'title#1', ...
+
+    Returns:
+        Tuple of (ids, metadatas, documents)
+    """
+    overlap = int(os.getenv('chunk_overlap', '32'))
+
+    ids, metadatas, documents = [], [], []
+    for meta in meta_batch_list:
+        chunks = chunk_text(meta['text'], chunk_budget(meta['title'], meta['tags']), overlap)
+        # Convert the IDs to ASCII
+        base_id = remove_non_ascii(meta['title'])
+        for i, (start, chunk) in enumerate(chunks):
+            chunk_meta = {
+                'title': meta['title'], 'text': chunk, 'tags': meta['tags'],
+                'category': meta.get('category', ''), 'parent': meta['title'], 'chunk': i, 'start': start,
+                **flatten_frontmatter(meta.get('frontmatter'))
+            }
+            ids.append(base_id if len(chunks) == 1 else f"{base_id}#{i}")
+            metadatas.append(chunk_meta)
+            documents.append(format_document(chunk_meta))
+    return ids, metadatas, documents
+
+
+def delete_notes(collection, titles):
+    """Delete every stored chunk of the given notes."""
+    titles = list(titles)
+    batch_size = collection.max_batch_size()
+    for i in range(0, len(titles), batch_size):
+        title_batch = titles[i:i + batch_size]
+        collection.delete(ids=[remove_non_ascii(title) for title in title_batch])
+        collection.delete(where={'parent': {'$in': title_batch}})
+
+
+def write_batch(collection, titles, ids, embeds, metadatas, documents):
+    """Replace every stored chunk of the given notes with the new ones."""
+    # Drop old chunks first so a note that shrank doesn't leave stale chunks behind
+    delete_notes(collection, titles)
+
+    collection.upsert(
+        ids=ids,
+        embeddings=embeds,
+        metadatas=metadatas,
+        documents=documents
+    )
+    index_keywords(titles, ids, metadatas, documents)
+
+
+def index_keywords(titles, ids, metadatas, documents):
+    """Replace the keyword index entries of the given notes with the new chunks."""
+    index = keyword_index.get_index()
+    index.remove_parents(titles)
+    index.add(ids, documents, [meta['parent'] for meta in metadatas])
+
+
+def invalidate_answers(titles, notes_added=False):
+    """
+    Drop cached answers that may be stale after the given notes changed.
+
+    Answers built from any of the notes are dropped. If notes_added, every
+    answer is dropped: a new note can change the answer to any question,
+    e.g. one that was answered "unknown" before the note existed.
+    """
+    cache = answer_cache.get_cache()
+    if cache:
+        if notes_added:
+            cache.clear()
+        else:
+            cache.invalidate_notes(titles)
+
+
+def has_new_notes(titles):
+    """True if any of the titles isn't indexed yet (call before index_titles())."""
+    index = title_index.get_index()
+    return any(title not in index for title in titles)
+
+
+def index_titles(titles, frontmatters):
+    """Record the titles and frontmatter aliases of the given notes for exact-title matching."""
+    title_index.get_index().update({
+        title: title_index.frontmatter_aliases(frontmatter) for title, frontmatter in zip(titles, frontmatters)
+    })
+
+
+def rebuild_title_index(collection):
+    """
+    Rebuild the title index from the note titles stored in the collection.
+
+    Aliases can't be recovered from the collection; they are picked up again
+    the next time each note is updated.
+
+    Returns:
+        TitleIndex instance
+    """
+    existing = collection.get(include=['metadatas'])
+    index = title_index.get_index()
+    index.update({
+        (meta or {}).get('parent', id): [] for id, meta in zip(existing['ids'], existing['metadatas'])
+    })
+    index.save()
+    return index
+
+
+def rebuild_keyword_index(collection):
+    """
+    Rebuild the keyword index from every document stored in the collection.
+
+    Used when the index file is missing, e.g. for collections ingested before
+    the keyword index existed.
+
+    Returns:
+        KeywordIndex instance
+    """
+    existing = collection.get(include=['metadatas', 'documents'])
+    index = keyword_index.get_index()
+    index.add(
+        existing['ids'],
+        existing['documents'],
+        [(meta or {}).get('parent', id) for id, meta in zip(existing['ids'], existing['metadatas'])]
+    )
+    index.save()
+    return index
+
+
+def prepare_frame(data):
+    """
+    Column-wise counterpart of prepare_batch() for a whole notes DataFrame.
+
+    Returns:
+        DataFrame with one row per chunk and id, title, text, tags, category,
+        parent, chunk, start, frontmatter (flattened), document and tokens columns
+    """
+    import numpy as np
+
+    overlap = int(os.getenv('chunk_overlap', '32'))
+
+    chunks = data[['title', 'text', 'tags', 'category', 'frontmatter']].copy()
+    chunks['frontmatter'] = chunks['frontmatter'].map(flatten_frontmatter)
+    chunks['text'] = [
+        chunk_text(text, chunk_budget(title, tags), overlap)
+        for title, text, tags in zip(chunks['title'], chunks['text'], chunks['tags'])
+    ]
+    chunks = chunks.explode('text', ignore_index=True)
+    chunks['start'] = [start for start, _ in chunks['text']]
+    chunks['text'] = [text for _, text in chunks['text']]
+
+    chunks['parent'] = chunks['title']
+    chunks['chunk'] = chunks.groupby('parent').cumcount()
+    chunk_counts = chunks.groupby('parent')['chunk'].transform('size')
+
+    # Convert the IDs to ASCII; notes that fit in one chunk keep their plain title
+    base_ids = chunks['title'].map(remove_non_ascii)
+    chunks['id'] = np.where(chunk_counts > 1, base_ids + '#' + chunks['chunk'].astype(str), base_ids)
+
+    # Same template as prepare_batch(), so both paths share embedding cache entries
+    chunks['document'] = [
+        format_document({'title': title, 'text': text, 'tags': tags})
+        for title, text, tags in zip(chunks['title'], chunks['text'], chunks['tags'])
+    ]
+    # Counted with the embedding model's tokenizer, since that is what gets padded per batch
+    tokenizer = get_embedding_model().tokenizer
+    chunks['tokens'] = [len(ids) for ids in tokenizer(chunks['document'].tolist(), verbose=False)['input_ids']]
+    return chunks
+
+
+def token_batches(token_counts, token_budget, max_batch_size):
+    """
+    Split chunks into embedding batches by padded token cost, longest first.
+
+    Sorting by length keeps similar lengths together so little padding is
+    wasted, and each batch holds as many chunks as fit in token_budget once
+    padded to its longest member.
+
+    Args:
+        token_counts: Series of token lengths
+        token_budget: Maximum padded tokens (batch size * longest chunk) per batch
+        max_batch_size: Hard cap on chunks per batch
+
+    Returns:
+        List of index arrays, one per batch
+    """
+    ordered = token_counts.sort_values(ascending=False, kind='stable')
+    batches = []
+    start = 0
+    lengths = ordered.to_numpy()
+    while start < len(lengths):
+        # Longest-first, so the first chunk sets the padded length of the batch
+        size = min(max(1, token_budget // max(int(lengths[start]), 1)), max_batch_size)
+        batches.append(ordered.index[start:start + size])
+        start += size
+    return batches
 
 
 def upsert_chromadb(data):
-    # Load environment variables for configuration
-    collection_name = os.getenv('chromadb_collection_name')
-    chromadb_path = os.getenv('chromadb_path', './chromadb')
+    """
+    Embed and upsert a notes DataFrame into ChromaDB.
 
-    print("Upsert to ChromaDB, Batches of 100")
-    batch_size = 100
+    Document strings and metadata are built column-wise, and chunks are
+    embedded in token-budgeted batches (embed_batch_tokens) instead of a fixed
+    number of rows. With embed_workers > 1, batches are encoded by a pool of
+    worker processes. Throughput is reported at the end.
 
-    # Initialize ChromaDB client
-    client = chromadb.PersistentClient(path=chromadb_path)
+    Args:
+        data: DataFrame with title, text, tags, category and frontmatter columns
+    """
+    start_time = time.perf_counter()
+    token_budget = int(os.getenv('embed_batch_tokens', '16384'))
 
     # Get or create collection
-    collection = client.get_or_create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"}
-    )
+    collection = get_collection(create=True)
 
-    # Process the data in batches
-    for i in tqdm(range(0, data.shape[0], batch_size)):
-        # Determine the end index of the current batch
-        i_end = min(len(data), i + batch_size)
-        meta_batch = data[i:i_end]
-
-        # Extract metadata from the batch
-        ids_batch = meta_batch['title'].tolist()
-
-        # Prepare the metadata for upserting
-        meta_batch_list = [{
-            'title': row['title'],
-            'text': row['text'],
-            'tags': row['tags']
-        } for _, row in meta_batch.iterrows()]
-
-        # Prepare documents for embedding (combining title, text, and tags)
-        documents = [
-            f"NAME: {meta['title']}\nENTRY: {meta['text']}\nTAGS: {meta['tags']}"
-            for meta in meta_batch_list
-        ]
+    chunks = prepare_frame(data)
+    batches = token_batches(chunks['tokens'], token_budget, collection.max_batch_size())
+    print(f"Upsert to ChromaDB, {len(chunks)} chunks in {len(batches)} token-budgeted batches")
 
-        # Create embeddings using local model
-        embeds = create_embeddings(documents)
+    # Drop old chunks of every note up front; a note's chunks may land in different batches
+    delete_notes(collection, data['title'].tolist())
+    index = keyword_index.get_index()
+    index.remove_parents(data['title'].tolist())
 
-        # Convert the IDs to ASCII
-        ascii_ids_batch = [remove_non_ascii(id) for id in ids_batch]
+    # Create embeddings using local model, optionally fanned out to worker processes
+    document_batches = [chunks.loc[batch_index, 'document'].tolist() for batch_index in batches]
+    workers = int(os.getenv('embed_workers', '1'))
+    if workers > 1 and len(batches) > 1:
+        embedded = embed_batches_multiprocess(document_batches, workers)
+    else:
+        embedded = (create_embeddings(documents, batch_size=len(documents)) for documents in document_batches)
+
+    metadata_columns = list(NOTE_METADATA_KEYS)
+    # embedded comes first so the generator runs to completion and prints its report
+    for embeds, batch_index, documents in tqdm(zip(embedded, batches, document_batches), total=len(batches)):
+        batch = chunks.loc[batch_index]
 
         # Upsert the data into ChromaDB
         collection.upsert(
-            ids=ascii_ids_batch,
+            ids=batch['id'].tolist(),
             embeddings=embeds,
-            metadatas=meta_batch_list,
+            metadatas=[
+                {**meta, **frontmatter} for meta, frontmatter in
+                zip(batch[metadata_columns].to_dict('records'), batch['frontmatter'])
+            ],
             documents=documents
         )
+        index.add(batch['id'].tolist(), documents, batch['parent'].tolist())
 
+    collection.flush()
+    index.save()
+    notes_added = has_new_notes(data['title'])
+    index_titles(data['title'], data['frontmatter'])
+    invalidate_answers(data['title'], notes_added)
+    title_index.get_index().save()
+    elapsed = time.perf_counter() - start_time
+    print(f"✓ Upserted {len(data)} notes ({len(chunks)} chunks) in {elapsed:.1f}s "
+          f"- {len(data) / max(elapsed, 1e-9):.1f} notes/s")
 
-def get_chromadb_context(query, mode='question'):
+
+def stream_upsert_chromadb(note_batches):
     """
-    Retrieve relevant context from ChromaDB based on query.
+    Embed and upsert notes as they stream in, without building a DataFrame.
+
+    Embedding runs on a background thread while the previous batch is being
+    written to ChromaDB, and it pulls from note_batches (itself a pipeline of
+    reading and tagging stages) through a bounded queue.
 
     Args:
-        query: The user's query/prompt
-        mode: 'question' for Q&A or 'generator' for content creation
+        note_batches: Iterable of lists of [title, text, tags, category, frontmatter] rows,
+            e.g. from data_code.iter_note_batches()
 
     Returns:
-        Formatted prompt with context and metadata
+        Number of notes upserted
     """
-    # Set environment variables
-    collection_name = os.getenv('chromadb_collection_name')
-    chromadb_path = os.getenv('chromadb_path', './chromadb')
-    top_k = int(os.getenv('top_k', '12'))
-    context_limit = int(os.getenv("chromadb_context_limit", "4000"))
+    collection = get_collection(create=True)
+
+    def embed_batch(rows):
+        meta_batch_list = [
+            {'title': title, 'text': text, 'tags': tags, 'category': category, 'frontmatter': frontmatter}
+            for title, text, tags, category, frontmatter in rows
+        ]
+        ids, metadatas, documents = prepare_batch(meta_batch_list)
+        return rows, ids, metadatas, documents, create_embeddings(documents)
+
+    upserted = 0
+    with tqdm(desc="Upserting", unit="notes") as progress:
+        for rows, ids, metadatas, documents, embeds in pipeline.run_stage(note_batches, embed_batch):
+            titles = [row[0] for row in rows]
+            write_batch(collection, titles, ids, embeds, metadatas, documents)
+            notes_added = has_new_notes(titles)
+            index_titles(titles, [row[4] for row in rows])
+            invalidate_answers(titles, notes_added)
+            upserted += len(titles)
+            progress.update(len(titles))
+
+    collection.flush()
+    keyword_index.get_index().save()
+    title_index.get_index().save()
+    return upserted
+
+
+def sync_chromadb(note_titles):
+    """
+    Delete collection entries whose note no longer exists on disk.
+
+    Lists every ID in the collection with a single get() call and bulk-deletes
+    the ones that don't match a current note title (deleted or renamed notes).
+
+    Args:
+        note_titles: Titles of the notes currently in the vault
+
+    Returns:
+        List of deleted IDs
+    """
+    collection = get_collection(create=True)
+
+    # One batched listing of every ID and its metadata, no embeddings or documents
+    existing = collection.get(include=['metadatas'])
+    titles = set(note_titles)
+    disk_ids = {remove_non_ascii(title) for title in titles}
+    orphans = [
+        (id, (meta or {}).get('parent', id)) for id, meta in zip(existing['ids'], existing['metadatas'])
+        if (meta or {}).get('parent', id) not in titles and id not in disk_ids
+    ]
+    orphan_ids = [id for id, _ in orphans]
+
+    batch_size = collection.max_batch_size()
+    for i in range(0, len(orphan_ids), batch_size):
+        collection.delete(ids=orphan_ids[i:i + batch_size])
+    collection.flush()
+
+    index = keyword_index.get_index()
+    index.remove_ids(orphan_ids)
+    index.save()
+    titles_index = title_index.get_index()
+    titles_index.remove([parent for _, parent in orphans])
+    titles_index.save()
+    invalidate_answers({parent for _, parent in orphans})
+
+    return orphan_ids
+
+
+def group_chunks(metadatas, distances=None, embeddings=None, relevances=None):
+    """
+    Merge chunk hits back into one result per parent note.
+
+    Notes are ranked by their best chunk and take its relevance and
+    embedding; the matched chunks of each note are joined in their original
+    order. Where neighbouring chunks overlap, the shared text is kept once
+    (using each chunk's 'start' offset).
+
+    Args:
+        metadatas: Chunk metadata dicts in ranked order
+        distances: Matching cosine distances (optional)
+        embeddings: Matching chunk embeddings (optional)
+        relevances: Chunk relevance scores, used instead of the distances
+            (e.g. the fused relevance from hybrid_search())
+
+    Returns:
+        List of dicts with title, text, tags and relevance, best first.
+        With embeddings, each note also has the 'embedding' of its best chunk.
+    """
+    notes = {}
+    for idx, metadata in enumerate(metadatas):
+        if relevances is not None:
+            relevance = relevances[idx]
+        else:
+            relevance = 1 - (distances[idx] if distances else 1.0)  # Convert distance to similarity
+        parent = metadata.get('parent', metadata['title'])
+        note = notes.setdefault(parent, {
+            'title': metadata['title'],
+            'tags': metadata['tags'],
+            'relevance': relevance,
+            'chunks': {}
+        })
+        if relevance > note['relevance']:
+            note['relevance'] = relevance
+            if embeddings is not None:
+                note['embedding'] = embeddings[idx]
+        elif embeddings is not None and 'embedding' not in note:
+            note['embedding'] = embeddings[idx]
+        note['chunks'][metadata.get('chunk', 0)] = (metadata.get('start'), metadata['text'])
+
+    for note in notes.values():
+        chunks = note.pop('chunks')
+        text, end = '', None
+        for i in sorted(chunks):
+            start, chunk = chunks[i]
+            if not text:
+                text = chunk
+            elif start is not None and end is not None and start <= end:
+                text += chunk[end - start:]
+            else:
+                text += "\n...\n" + chunk
+            end = start + len(chunk) if start is not None else None
+        note['text'] = text
+    return list(notes.values())
+
+
+def mmr_select(relevance, embeddings, k, lambda_mult=0.7):
+    """
+    Pick a diverse subset with maximal marginal relevance.
+
+    Each step takes the candidate maximizing
+    lambda_mult * relevance - (1 - lambda_mult) * (max similarity to those already picked),
+    so near-duplicates of an earlier pick are pushed down.
+
+    Args:
+        relevance: Candidate similarities to the query
+        embeddings: Candidate embeddings, one row per candidate
+        k: Number of candidates to pick
+        lambda_mult: 1.0 ranks purely by relevance, 0.0 purely by diversity
+
+    Returns:
+        Indices of the picked candidates, in pick order
+    """
+    import numpy as np
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    similarity = vectors @ vectors.T
+
+    k = min(k, len(relevance))
+    picked = []
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    for _ in range(k):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+def adaptive_cutoff(relevances, min_relevance=0.0, max_drop=1.0, max_gap=1.0, min_results=1):
+    """
+    Number of results to keep from a relevance-sorted list.
+
+    Stops at the first result that is below min_relevance, has fallen more than
+    max_drop (a fraction) below the best result, or sits more than max_gap
+    below the result before it (the elbow).
+
+    Args:
+        relevances: Relevance scores, best first
+        min_relevance: Absolute floor
+        max_drop: Largest allowed drop relative to the best score
+        max_gap: Largest allowed drop between neighbours
+        min_results: Always keep at least this many
+
+    Returns:
+        Number of leading results to keep
+    """
+    if not relevances:
+        return 0
+    best = relevances[0]
+    for i, relevance in enumerate(relevances):
+        if i < min_results:
+            continue
+        if (relevance < min_relevance or relevance < best * (1 - max_drop)
+                or relevances[i - 1] - relevance > max_gap):
+            return i
+    return len(relevances)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Combine several ranked ID lists with reciprocal rank fusion.
+
+    Each list contributes 1 / (k + rank) to an ID's score, so IDs ranked well
+    by any retriever rise to the top without comparing raw scores.
+
+    Args:
+        rankings: Lists of IDs, best first
+        k: Damping constant (60 in the original RRF paper)
+
+    Returns:
+        IDs ordered by fused score, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
 
-    # Embed query using local model
-    query_embedding = create_embeddings([query])[0]
 
-    # Initialize ChromaDB client
-    client = chromadb.PersistentClient(path=chromadb_path)
+def _add_timing(stage, start):
+    """Add the time since start (perf_counter) to a stage of last_retrieval_timings."""
+    key = f"{stage}_ms"
+    last_retrieval_timings[key] = last_retrieval_timings.get(key, 0.0) + (time.perf_counter() - start) * 1000
 
-    # Get collection
-    collection = client.get_collection(name=collection_name)
 
-    # Query ChromaDB
+def _vector_search(collection, queries, n_results, where=None):
+    """Embed every query in one encode call and run one multi-query ANN search."""
+    start = time.perf_counter()
+    query_embeddings = create_embeddings(queries, batch_size=len(queries))
     results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=top_k,
-        include=['metadatas', 'documents', 'distances']
+        query_embeddings=query_embeddings,
+        n_results=n_results,
+        where=where,
+        include=['metadatas', 'distances', 'embeddings']
     )
+    _add_timing('vector', start)
+    return query_embeddings, results
+
+
+def _keyword_search(collection, queries, n_results):
+    """Run the BM25 search for every query. Returns one [(id, score), ...] list per query."""
+    start = time.perf_counter()
+    index = keyword_index.get_index()
+    if not len(index) and collection.count():
+        index = rebuild_keyword_index(collection)
+    hits = [index.search(query, n_results) for query in queries]
+    _add_timing('keyword', start)
+    return hits
+
+
+# Runs the vector and keyword searches side by side
+_search_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='search')
+
+
+def hybrid_search(collection, queries, n_results, where=None):
+    """
+    Retrieve chunks with BM25 and vector search combined by reciprocal rank fusion.
+
+    Both searches run concurrently, and each handles all queries at once: one
+    encode call and one multi-query ChromaDB search. Chunks found only by the
+    keyword index get their cosine distance computed from their stored
+    embeddings. Set hybrid_search="False" for vector search only. Per-stage
+    latency is added to last_retrieval_timings.
+
+    Each chunk also gets a fused relevance: the fused ranking carried onto
+    the cosine scale, i.e. the n-th ranked chunk gets the n-th highest cosine
+    similarity in the pool. It falls with fused rank, so keyword hits keep
+    their place in MMR and the adaptive cutoff, while thresholds keep their
+    meaning. Without hybrid search it is the chunk's own cosine similarity.
+
+    Args:
+        collection: ChromaDB collection
+        queries: List of query texts
+        n_results: Number of chunks to return per query
+        where: Optional ChromaDB metadata filter, e.g. {'category': 'People'}
+
+    Returns:
+        One (metadatas, distances, embeddings, relevances) tuple per query, in fused rank order
+    """
+    import numpy as np
+
+    hybrid = os.getenv('hybrid_search', 'True') == 'True'
+
+    vector_future = _search_executor.submit(_vector_search, collection, queries, n_results, where)
+    keyword_future = _search_executor.submit(_keyword_search, collection, queries, n_results) if hybrid else None
+    query_embeddings, results = vector_future.result()
+    keyword_hits = keyword_future.result() if keyword_future else [[] for _ in queries]
+
+    fusion_start = time.perf_counter()
+    rrf_k = int(os.getenv('rrf_k', '60'))
+    found, rankings = [], []
+    for i in range(len(queries)):
+        found.append(dict(zip(
+            results['ids'][i],
+            zip(results['metadatas'][i], results['distances'][i], results['embeddings'][i])
+        )))
+        rankings.append(reciprocal_rank_fusion([results['ids'][i], [id for id, _ in keyword_hits[i]]], k=rrf_k)[:n_results])
 
+    # Chunks only the keyword index found, fetched in one call for all queries.
+    # The keyword index has no metadata, so the filter is applied here.
+    keyword_only = sorted({id for i, ranked_ids in enumerate(rankings) for id in ranked_ids if id not in found[i]})
+    extra = collection.get(ids=keyword_only, where=where, include=['metadatas', 'embeddings']) if keyword_only else None
+    if extra and extra['ids']:
+        embeddings = np.asarray(extra['embeddings'], dtype=np.float32)
+        embeddings = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+        query_vectors = np.asarray(query_embeddings, dtype=np.float32)
+        query_vectors = query_vectors / (np.linalg.norm(query_vectors, axis=1, keepdims=True) + 1e-12)
+        similarities = query_vectors @ embeddings.T
+        for i, ranked_ids in enumerate(rankings):
+            wanted = set(ranked_ids) - found[i].keys()
+            for j, (id, meta) in enumerate(zip(extra['ids'], extra['metadatas'])):
+                if id in wanted:
+                    found[i][id] = (meta, 1 - float(similarities[i, j]), extra['embeddings'][j])
+
+    fused = []
+    for i, ranked_ids in enumerate(rankings):
+        ranked_ids = [id for id in ranked_ids if id in found[i]]
+        metadatas, distances, embeddings = ([found[i][id][field] for id in ranked_ids] for field in range(3))
+        relevances = sorted((1 - distance for distance in distances), reverse=True)
+        fused.append((metadatas, distances, embeddings, relevances))
+    _add_timing('fusion', fusion_start)
+    return fused
+
+
+def title_search(collection, query, max_notes, where=None):
+    """
+    Fetch the notes whose title or alias appears verbatim in the query.
+
+    The query is scanned once by the title index's Aho-Corasick automaton and
+    the matched notes are fetched by parent title, without embedding the query.
+    Exact matches get relevance 1.0.
+
+    Args:
+        collection: ChromaDB collection
+        query: Query text
+        max_notes: Maximum number of notes to fetch
+        where: Optional ChromaDB metadata filter
+
+    Returns:
+        Tuple of (matched titles, metadatas, distances), in query order
+    """
+    start = time.perf_counter()
+    index = title_index.get_index()
+    if not len(index) and collection.count():
+        index = rebuild_title_index(collection)
+
+    matched = index.match(query)[:max_notes]
+    metadatas = []
+    if matched:
+        title_filter = {'parent': {'$in': matched}}
+        found = collection.get(
+            where={'$and': [title_filter, where]} if where else title_filter,
+            include=['metadatas']
+        )
+        metadatas = sorted(
+            found['metadatas'],
+            key=lambda meta: (matched.index(meta['parent']), meta.get('chunk', 0))
+        )
+        # Notes renamed since the index was built aren't in the collection any more
+        present = {meta['parent'] for meta in metadatas}
+        matched = [title for title in matched if title in present]
+
+    _add_timing('title', start)
+    return matched, metadatas, [0.0] * len(metadatas)
+
+
+def select_notes(query, candidates, slots, pinned):
+    """
+    Pick the search results that fill a query's remaining context slots.
+
+    Applies, in order, the optional cross-encoder reranker, the adaptive
+    top_k cutoff and MMR diversification.
+
+    Args:
+        query: Query text
+        candidates: Notes from group_chunks(), best first
+        slots: Number of notes to pick at most
+        pinned: Number of notes already included by title match
+
+    Returns:
+        Selected notes
+    """
+    # Optional cross-encoder pass over the best candidates replaces their relevance scores
+    cross_encoder = reranker.get_reranker()
+    if cross_encoder and candidates:
+        rerank_start = time.perf_counter()
+        candidates = candidates[:int(os.getenv('rerank_top_n', '30'))]
+        for note, score in zip(candidates, cross_encoder.score(query, candidates)):
+            note['relevance'] = score
+        candidates.sort(key=lambda note: note['relevance'], reverse=True)
+        _add_timing('rerank', rerank_start)
+
+    # Adaptive mode: top_k is only the ceiling, weak results after a drop-off are left out.
+    # Fused relevance already falls with rank, so this sort only matters for mixed sources.
+    if os.getenv('adaptive_top_k', 'False') == 'True' and candidates:
+        candidates.sort(key=lambda note: note['relevance'], reverse=True)
+        candidates = candidates[:adaptive_cutoff(
+            [note['relevance'] for note in candidates],
+            min_relevance=float(os.getenv('min_relevance', '0.3')),
+            max_drop=float(os.getenv('relevance_drop', '0.5')),
+            max_gap=float(os.getenv('relevance_gap', '0.15')),
+            min_results=0 if pinned else 1
+        )]
+
+    if os.getenv('mmr', 'True') == 'True' and len(candidates) > slots:
+        mmr_start = time.perf_counter()
+        picked = mmr_select(
+            [note['relevance'] for note in candidates],
+            [note['embedding'] for note in candidates],
+            slots,
+            float(os.getenv('mmr_lambda', '0.7'))
+        )
+        candidates = [candidates[i] for i in picked]
+        _add_timing('mmr', mmr_start)
+    return candidates[:slots]
+
+
+def build_prompt(query, notes, mode='question', model=None):
+    """
+    Build the LLM prompt for a query from its retrieved notes.
+
+    Returns:
+        Tuple of (prompt, relevance_data)
+    """
     # Get contexts from results with relevance scores
     contexts = []
     relevance_data = []
 
-    if results['metadatas'] and len(results['metadatas'][0]) > 0:
-        for idx, metadata in enumerate(results['metadatas'][0]):
-            distance = results['distances'][0][idx] if results['distances'] else 1.0
-            relevance_score = 1 - distance  # Convert distance to similarity
-
-            context_text = f"{metadata['title']}: {metadata['text']}\nTags: {metadata['tags']}"
-            contexts.append(context_text)
+    for note in notes:
+        context_text = f"{note['title']}: {note['text']}\nTags: {note['tags']}"
+        contexts.append(context_text)
 
-            relevance_data.append({
-                'title': metadata['title'],
-                'relevance': relevance_score,
-                'tags': metadata['tags']
-            })
+        relevance_data.append({
+            'title': note['title'],
+            'relevance': note['relevance'],
+            'tags': note['tags']
+        })
 
     # Build prompt based on mode
     if mode == 'generator':
@@ -153,14 +1217,78 @@ EXISTING LORE CONTEXT:
         prompt_start = "Answer the question based on the context below.\n\nContext:\n"
         prompt_end = f"\n\nQuestion: {query}\nAnswer:"
 
-    # Build context with character limit
-    prompt = ""
-    for i in range(1, len(contexts) + 1):
-        current_prompt = "\n\n---\n\n".join(contexts[:i])
-        if len(current_prompt) >= context_limit:
-            prompt = prompt_start + "\n\n---\n\n".join(contexts[:i - 1]) + prompt_end
-            break
-        elif i == len(contexts):
-            prompt = prompt_start + current_prompt + prompt_end
+    # Pack context into the token budget left by the target model's context window
+    model = model or os.getenv('openrouter_model', 'anthropic/claude-3.5-sonnet')
+    token_budget = llm_code.get_context_budget(model, prompt_start + prompt_end)
+    prompt = prompt_start + llm_code.pack_context(contexts, token_budget) + prompt_end
+
+    return prompt, relevance_data
+
+
+def get_chromadb_contexts(queries, mode='question', model=None, where=None):
+    """
+    Retrieve context for several queries in one pass.
+
+    Queries that aren't fully answered by title matches are embedded in one
+    encode call and searched with one multi-query ChromaDB call.
 
-    return prompt, relevance_data
\ No newline at end of file
+    Args:
+        queries: List of user queries/prompts
+        mode: 'question' for Q&A or 'generator' for content creation
+        model: Model the prompts are for, sizes the context budget
+            (defaults to openrouter_model)
+        where: Optional ChromaDB metadata filter applied to every retrieval
+            path, e.g. {'category': 'People'} or {'category': {'$in': ['People', 'Places']}}
+
+    Returns:
+        List of (prompt, relevance_data) tuples, in input order
+    """
+    # Set environment variables
+    top_k = int(os.getenv('top_k', '12'))
+
+    # Get collection (cached across queries)
+    collection = get_collection()
+
+    start = time.perf_counter()
+    last_retrieval_timings.clear()
+
+    # Notes named in a query come first and are guaranteed a slot
+    matches = [([], [], [])] * len(queries)
+    if os.getenv('title_match', 'True') == 'True':
+        matches = [title_search(collection, query, top_k, where) for query in queries]
+    notes = [group_chunks(metadatas, distances) for _, metadatas, distances in matches]
+
+    # Fill the remaining slots by search, skipped for queries whose titles alone fill top_k
+    to_search = [i for i, (matched, _, _) in enumerate(matches) if len(matched) < top_k]
+    if to_search:
+        # Over-fetch chunks so they can be merged back into notes; MMR picks from a larger pool
+        n_results = top_k * int(os.getenv('chunk_overfetch', '3'))
+        if os.getenv('mmr', 'True') == 'True':
+            n_results = max(n_results, int(os.getenv('mmr_pool_size', '60')))
+
+        searched = hybrid_search(collection, [queries[i] for i in to_search], n_results, where)
+        for i, chunks in zip(to_search, searched):
+            matched = matches[i][0]
+            candidates = [note for note in group_chunks(*chunks) if note['title'] not in matched]
+            notes[i] += select_notes(queries[i], candidates, top_k - len(matched), len(matched))
+
+    last_retrieval_timings['total_ms'] = (time.perf_counter() - start) * 1000
+
+    return [build_prompt(query, query_notes, mode, model) for query, query_notes in zip(queries, notes)]
+
+
+def get_chromadb_context(query, mode='question', model=None, where=None):
+    """
+    Retrieve relevant context from ChromaDB based on query.
+
+    Args:
+        query: The user's query/prompt
+        mode: 'question' for Q&A or 'generator' for content creation
+        model: Model the prompt is for, sizes the context budget
+            (defaults to openrouter_model)
+        where: Optional ChromaDB metadata filter (see get_chromadb_contexts)
+
+    Returns:
+        Formatted prompt with context and metadata
+    """
+    return get_chromadb_contexts([query], mode=mode, model=model, where=where)[0]
@@ -1,58 +1,516 @@
 import csv
+import hashlib
+import json
 import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from tqdm.auto import tqdm
 
 import llm_code
+import pipeline
+from persistence import atomic_open, write_json_atomic
 
 gpt_override_cost_check = bool(os.getenv('gpt_override_cost_check'))
 
-def make_notes_df():
-    notes_dir = Path("Notes")
-    tags_file = notes_dir / 'tags.csv'
+NOTE_COLUMNS = ['title', 'text', 'tags', 'category', 'frontmatter']
+
+
+def get_manifest_path():
+    """Location of the ingest manifest (defaults to a file beside the Chroma store)."""
+    manifest_path = os.getenv('notes_manifest_path')
+    if manifest_path:
+        return Path(manifest_path)
+    chromadb_path = os.getenv('chromadb_path', './chromadb')
+    collection_name = os.getenv('chromadb_collection_name', 'world_whisper_collection')
+    return Path(chromadb_path) / f"{collection_name}_manifest.json"
+
+
+def load_manifest(fingerprint=None):
+    """
+    Load the ingest manifest.
+
+    Args:
+        fingerprint: Current ingest settings (chromadb_code.ingest_fingerprint()).
+            A manifest written under other settings is discarded.
 
-    # Read tags.csv and create a dictionary with title as key and tags as value
-    tags_dict = {}
-    if tags_file.exists():
-        with tags_file.open('r') as f:
-            reader = csv.DictReader(f)
-            tags_dict = {row["title"]: row["tags"] for row in reader}
+    Returns:
+        Tuple of (manifest, stale). manifest maps note path to
+        {'title', 'mtime', 'size', 'hash'}. stale is True if the manifest was
+        discarded because the ingest settings changed; every note then counts
+        as new, and the old collection should be reset before upserting.
+    """
+    manifest_path = get_manifest_path()
+    if not manifest_path.exists():
+        return {}, False
+    with manifest_path.open('r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if fingerprint is not None and saved.get('fingerprint') != fingerprint:
+        return {}, True
+    return saved.get('notes', {}), False
 
-    headers = ['title', 'text', 'tags']
-    output_rows = []
 
+def save_manifest(manifest, fingerprint=None):
+    """Atomically write the ingest manifest along with the ingest settings it was built under."""
+    write_json_atomic(get_manifest_path(), {'fingerprint': fingerprint, 'notes': manifest}, indent=1, sort_keys=True)
+
+
+def hash_text(text):
+    """Content hash used to detect changed notes."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def iter_note_files(notes_dir=Path("Notes")):
+    """Yield (item_type, markdown_file) for every note in the vault."""
     for type_dir in notes_dir.iterdir():
         if type_dir.is_dir():
             for markdown_file in type_dir.glob('*.md'):
-                with markdown_file.open('r') as f:
-                    text = f.read()
-
-                title = markdown_file.stem
-                item_type = type_dir.name
-
-                if title not in tags_dict:
-                    print(f"New note found.\nCreating tags for {markdown_file}")
-                    file_contents = text
-                    tags = gpt_code.llm(
-                        "You a DnD Dungeon Master AI, master of Vector Databases and Fantasy Lore.",
-                        file_contents,
-                        """Create a list of up to 10 tags about this Lore entry, for the purpose of
-                        training a vector database. Return only the tags, separated by |""",
-                        skip_cost_check=True  # Auto-accept for tag generation
-                    )
-
-                    tags_dict[title] = tags
-                    # Append the new tags to the tags.csv file
-                    with tags_file.open('a', newline='') as f:
-                        writer = csv.writer(f)
-                        writer.writerow([title, tags])
-                else:
-                    tags = tags_dict[title]
-
-                text = text.strip("\n")
-                output_rows.append([title, text, tags])
-
-    notes_df = pd.DataFrame(output_rows, columns=headers)
-
-    return notes_df
+                yield type_dir.name, markdown_file
+
+
+def parse_frontmatter(text):
+    """
+    Split Obsidian-style YAML frontmatter off a note.
+
+    Understands the simple forms Obsidian writes: 'key: value',
+    'key: [a, b]' and 'key:' followed by '- item' lines.
+
+    Returns:
+        Tuple of (frontmatter dict, body text). The dict is empty if the note
+        has no frontmatter.
+    """
+    lines = text.split('\n')
+    if not lines or lines[0].strip() != '---':
+        return {}, text
+    try:
+        end = next(i for i in range(1, len(lines)) if lines[i].strip() == '---')
+    except StopIteration:
+        return {}, text
+
+    frontmatter = {}
+    key = None
+    for line in lines[1:end]:
+        stripped = line.strip()
+        if stripped.startswith('- ') and key is not None:
+            frontmatter.setdefault(key, [])
+            if isinstance(frontmatter[key], list):
+                frontmatter[key].append(stripped[2:].strip().strip('"\''))
+        elif ':' in stripped:
+            key, value = (part.strip() for part in stripped.split(':', 1))
+            if value.startswith('[') and value.endswith(']'):
+                frontmatter[key] = [item.strip().strip('"\'') for item in value[1:-1].split(',') if item.strip()]
+            elif value:
+                frontmatter[key] = value.strip('"\'')
+    return frontmatter, '\n'.join(lines[end + 1:])
+
+
+def list_note_categories(notes_dir=Path("Notes")):
+    """Note categories, i.e. the folder names in the vault."""
+    return sorted(type_dir.name for type_dir in notes_dir.iterdir() if type_dir.is_dir())
+
+
+def list_note_titles():
+    """Titles of every note currently in the vault, without reading the files."""
+    return [markdown_file.stem for _, markdown_file in iter_note_files()]
+
+
+def load_tags(tags_file):
+    """Read tags.csv into a dict with title as key and tags as value."""
+    if not tags_file.exists():
+        return {}
+    with tags_file.open('r') as f:
+        reader = csv.DictReader(f, skipinitialspace=True)
+        return {row["title"]: row["tags"] for row in reader}
+
+
+def save_tags(tags_dict, tags_file):
+    """Atomically rewrite tags.csv from a title -> tags dict."""
+    with atomic_open(tags_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'tags'])
+        writer.writerows(tags_dict.items())
+
+
+def generate_tags(text):
+    """Ask the LLM for up to 10 tags for a single lore entry."""
+    messages = [
+        {"role": "system", "content": "You a DnD Dungeon Master AI, master of Vector Databases and Fantasy Lore."},
+        {"role": "assistant", "content": f"The context provided: \n{text}"},
+        {"role": "user", "content": """Create a list of up to 10 tags about this Lore entry, for the purpose of
+        training a vector database. Return only the tags, separated by |"""}
+    ]
+    model = os.getenv('openrouter_model', 'anthropic/claude-3.5-sonnet')
+    return llm_code.call_openrouter(messages, model=model).strip()
+
+
+def _parse_batch_tags(response, titles):
+    """Parse a JSON object of title -> tag list from a batched tagging response."""
+    try:
+        parsed = json.loads(response)
+    except ValueError:
+        # Strip any prose or code fence around the object
+        start, end = response.find('{'), response.rfind('}')
+        if start == -1 or end == -1:
+            raise ValueError("No JSON object in tagging response")
+        parsed = json.loads(response[start:end + 1])
+    if not isinstance(parsed, dict):
+        raise ValueError(f"Expected a JSON object of title -> tags, got {type(parsed).__name__}")
+
+    tags = {}
+    for title in titles:
+        value = parsed.get(title)
+        if isinstance(value, list):
+            value = "|".join(str(tag).strip() for tag in value)
+        if value:
+            tags[title] = value
+    return tags
+
+
+def generate_tags_batch(notes):
+    """
+    Ask the LLM for tags for several lore entries in one request.
+
+    Any note missing from the structured answer, or the whole batch if the
+    answer can't be parsed, falls back to one generate_tags() call per note.
+    A failed fallback call only loses that note's tags.
+
+    Args:
+        notes: Dict of title -> note text
+
+    Returns:
+        Dict of title -> tags (notes whose tagging failed are left out)
+    """
+    if len(notes) == 1:
+        (title, text), = notes.items()
+        return {title: generate_tags(text)}
+
+    entries = "\n\n".join(f"### {title}\n{text}" for title, text in notes.items())
+    messages = [
+        {"role": "system", "content": "You a DnD Dungeon Master AI, master of Vector Databases and Fantasy Lore."},
+        {"role": "assistant", "content": f"The context provided: \n{entries}"},
+        {"role": "user", "content": """For each Lore entry above (each starts with ### and its title), create a list
+        of up to 10 tags, for the purpose of training a vector database. Return only a JSON object
+        mapping each exact title to a list of tag strings."""}
+    ]
+    model = os.getenv('openrouter_model', 'anthropic/claude-3.5-sonnet')
+
+    try:
+        response = llm_code.call_openrouter(messages, model=model, temperature=0.3)
+        tags = _parse_batch_tags(response, notes.keys())
+    except ValueError as e:
+        print(f"Warning: could not parse batched tags ({e}), tagging {len(notes)} notes one by one")
+        tags = {}
+
+    for title, text in notes.items():
+        if title not in tags:
+            try:
+                tags[title] = generate_tags(text)
+            except Exception as e:
+                print(f"Warning: tag generation failed for {title} ({e}), will retry next update")
+    return tags
+
+
+def _pack_tag_batches(notes, token_budget):
+    """Group notes into batches whose combined text fits within token_budget."""
+    batches = []
+    current, current_tokens = {}, 0
+    for title, text in notes.items():
+        note_tokens = llm_code.count_tokens(text) + llm_code.count_tokens(title) + 4
+        if current and current_tokens + note_tokens > token_budget:
+            batches.append(current)
+            current, current_tokens = {}, 0
+        current[title] = text
+        current_tokens += note_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def tag_notes(notes, tags_dict, tags_file):
+    """
+    Generate tags for new notes across a bounded worker pool.
+
+    With tag_mode="batch", notes are packed into requests of up to
+    tag_batch_tokens tokens each; otherwise every note is its own request.
+    Results are collected in memory and tags.csv is rewritten once at the end.
+    If the run is interrupted, the tags finished so far are still written, so
+    the next run only has to tag the remainder.
+
+    Args:
+        notes: Dict of title -> note text for notes that need tags
+        tags_dict: Existing title -> tags dict, updated in place
+        tags_file: Path to tags.csv
+
+    Returns:
+        Dict of title -> tags for the notes that were tagged successfully
+    """
+    max_workers = int(os.getenv('tag_workers', '4'))
+    tag_mode = os.getenv('tag_mode', 'single')
+
+    if tag_mode == 'batch':
+        token_budget = int(os.getenv('tag_batch_tokens', '6000'))
+        batches = _pack_tag_batches(notes, token_budget)
+        print(f"Tagging {len(notes)} notes in {len(batches)} batched requests")
+    else:
+        batches = [{title: text} for title, text in notes.items()]
+
+    completed = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {executor.submit(generate_tags_batch, batch): batch for batch in batches}
+        with tqdm(total=len(notes), desc="Tagging") as progress:
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    completed.update(future.result())
+                except Exception as e:
+                    print(f"Warning: tag generation failed for {', '.join(batch)} ({e}), will retry next update")
+                progress.update(len(batch))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if completed:
+            tags_dict.update(completed)
+            save_tags(tags_dict, tags_file)
+
+    return completed
+
+
+_STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further had
+has have having he her here hers herself him himself his how i if in into is it its itself just
+may me might more most much must my myself no nor not now of off on once only or other our ours
+ourselves out over own same she should so some such than that the their theirs them themselves
+then there these they this those through to too under until up upon very was we were what when
+where which while who whom why will with within without would you your yours yourself
+""".split())
+
+
+# Runs of 3+ Unicode letters; digits, hyphens and apostrophes split words
+_TERM_PATTERN = re.compile(r"[^\W\d_]{3,}")
+
+
+def _note_terms(texts):
+    """Explode a Series of note texts into one lowercase, stopword-free term per row."""
+    terms = texts.str.lower().str.findall(_TERM_PATTERN).explode().dropna()
+    return terms[~terms.isin(_STOPWORDS)]
+
+
+def vault_document_frequencies(notes_dir=Path("Notes")):
+    """
+    Count, for every term, how many notes in the whole vault contain it.
+
+    Reads one note at a time, so memory grows with the vocabulary rather than
+    the vault; used so local tags are scored against the vault rather than
+    only the notes being ingested.
+
+    Returns:
+        Tuple of (Series of document frequency indexed by term, number of notes)
+    """
+    doc_freq = Counter()
+    n_notes = 0
+    for _, markdown_file in iter_note_files(notes_dir):
+        with markdown_file.open('r') as f:
+            _, body = parse_frontmatter(f.read())
+        terms = set(_TERM_PATTERN.findall((markdown_file.stem + ' ' + body).lower())) - _STOPWORDS
+        doc_freq.update(terms)
+        n_notes += 1
+    return pd.Series(doc_freq, dtype='int64'), n_notes
+
+
+def extract_local_tags(notes_df, max_tags=None, doc_freqs=None):
+    """
+    Generate tags locally with TF-IDF keyword scoring, no LLM round-trip.
+
+    Scores every term in every note in one vectorized pass over the DataFrame.
+    Term frequencies come from notes_df; document frequencies come from
+    doc_freqs (normally vault_document_frequencies()), or from notes_df itself
+    if it isn't given.
+
+    Args:
+        notes_df: DataFrame with title and text columns
+        max_tags: Tags per note (defaults to local_tag_count env var, 10)
+        doc_freqs: Optional (document frequency Series, number of notes) tuple
+
+    Returns:
+        Series of '|'-separated tags aligned with notes_df's index
+    """
+    max_tags = max_tags or int(os.getenv('local_tag_count', '10'))
+
+    terms = _note_terms(notes_df['title'] + ' ' + notes_df['text'])
+    if terms.empty:
+        return pd.Series("", index=notes_df.index)
+
+    # Term counts per (note, term)
+    counts = terms.groupby([terms.index, terms.values]).size()
+    counts.index.names = ['note', 'term']
+
+    term_freq = counts / counts.groupby(level='note').transform('sum')
+    if doc_freqs is None:
+        doc_freq = counts.groupby(level='term').transform('size')
+        n_docs = len(notes_df)
+    else:
+        vault_doc_freq, n_docs = doc_freqs
+        # Terms missing from the vault counts (e.g. a note edited since the scan) count as one note
+        doc_freq = pd.Series(
+            vault_doc_freq.reindex(counts.index.get_level_values('term')).fillna(1).to_numpy(),
+            index=counts.index
+        )
+    inverse_doc_freq = np.log((1 + n_docs) / (1 + doc_freq)) + 1
+    scores = (term_freq * inverse_doc_freq).sort_values(ascending=False, kind='stable')
+
+    top_terms = scores.groupby(level='note').head(max_tags).reset_index()
+    tags = top_terms.groupby('note')['term'].agg('|'.join)
+    return tags.reindex(notes_df.index, fill_value="")
+
+
+def iter_changed_notes(manifest, new_manifest, stats, tags_dict):
+    """
+    Scan the vault and yield [title, text, tags, category, frontmatter] for
+    every new or changed note. category is the note's folder (People, Places,
+    ...), text is the note body without its frontmatter.
+
+    Compares each file against the manifest, filling new_manifest and the
+    'added', 'changed', 'unchanged' and 'removed' counts in stats as it goes.
+    tags is None for notes that still need tags.
+    """
+    tag_mode = os.getenv('tag_mode', 'single')
+    notes_dir = Path("Notes")
+
+    for item_type, markdown_file in iter_note_files(notes_dir):
+        title = markdown_file.stem
+        note_path = markdown_file.as_posix()
+        stat = markdown_file.stat()
+        previous = manifest.get(note_path)
+        # Notes indexed with local or failed tags get LLM tags once an LLM mode is enabled
+        needs_tags = title not in tags_dict and tag_mode != 'local'
+
+        # Fast path: same size and mtime as last ingest, no need to read the file
+        if (previous and previous['title'] == title and not needs_tags
+                and previous['mtime'] == stat.st_mtime and previous['size'] == stat.st_size):
+            new_manifest[note_path] = previous
+            stats['unchanged'] += 1
+            continue
+
+        with markdown_file.open('r') as f:
+            text = f.read()
+
+        entry = {'title': title, 'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': hash_text(text)}
+        new_manifest[note_path] = entry
+
+        if (previous and previous['title'] == title and not needs_tags
+                and previous['hash'] == entry['hash']):
+            # Touched but not edited
+            stats['unchanged'] += 1
+            continue
+        stats['changed' if previous else 'added'] += 1
+
+        frontmatter, body = parse_frontmatter(text)
+        yield [title, body.strip("\n"), tags_dict.get(title), item_type, frontmatter]
+
+    # Notes in the old manifest that are no longer on disk were deleted or renamed
+    stats['removed'] = len(manifest.keys() - new_manifest.keys())
+
+
+def apply_tags(rows, tags_dict, tags_file, doc_freqs=None):
+    """
+    Fill in tags for rows from iter_changed_notes() that don't have any yet.
+
+    Uses the tagging mode from the tag_mode env var. Rows are updated in place.
+    Local tags are scored against doc_freqs from vault_document_frequencies(),
+    which is computed here if not given.
+    """
+    untagged = {row[0]: row[1] for row in rows if row[2] is None}
+    if not untagged:
+        return rows
+
+    if os.getenv('tag_mode', 'single') == 'local':
+        # Local tags are not written to tags.csv, so an LLM mode can refine them later
+        print(f"{len(untagged)} new notes found. Extracting local tags...")
+        local_tags = extract_local_tags(
+            pd.DataFrame(rows, columns=NOTE_COLUMNS),
+            doc_freqs=doc_freqs or vault_document_frequencies()
+        )
+        for row, tags in zip(rows, local_tags):
+            if row[2] is None:
+                row[2] = tags
+    else:
+        print(f"{len(untagged)} new notes found. Creating tags...")
+        tag_notes(untagged, tags_dict, tags_file)
+        for row in rows:
+            # Notes whose tagging failed get empty tags and are retried next update
+            if row[2] is None:
+                row[2] = tags_dict.get(row[0], "")
+    return rows
+
+
+def _collect_notes(manifest):
+    """
+    Walk the vault, tagging new notes and comparing each file against the manifest.
+
+    Returns:
+        Tuple of (rows, new_manifest, stats)
+    """
+    tags_file = Path("Notes") / 'tags.csv'
+    tags_dict = load_tags(tags_file)
+    new_manifest = {}
+    stats = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+
+    rows = list(iter_changed_notes(manifest, new_manifest, stats, tags_dict))
+    apply_tags(rows, tags_dict, tags_file)
+
+    return rows, new_manifest, stats
+
+
+def iter_note_batches(manifest, new_manifest, stats, batch_size=100):
+    """
+    Streaming counterpart of make_changed_notes_df().
+
+    Reading and tagging run on their own background threads, connected by
+    bounded queues, so at most a few batches of notes are held in memory.
+
+    Yields:
+        Lists of up to batch_size tagged [title, text, tags, category, frontmatter] rows.
+        new_manifest and stats are complete once the generator is exhausted.
+    """
+    tags_file = Path("Notes") / 'tags.csv'
+    tags_dict = load_tags(tags_file)
+
+    notes = iter_changed_notes(manifest, new_manifest, stats, tags_dict)
+    batches = pipeline.run_stage(pipeline.batched(notes, batch_size))
+
+    doc_freqs = []
+
+    def tag_batch(rows):
+        # Scan the vault for local-tag document frequencies once, on the first batch that needs them
+        if not doc_freqs and os.getenv('tag_mode', 'single') == 'local' and any(row[2] is None for row in rows):
+            doc_freqs.append(vault_document_frequencies())
+        return apply_tags(rows, tags_dict, tags_file, doc_freqs[0] if doc_freqs else None)
+
+    return pipeline.run_stage(batches, tag_batch)
+
+
+def make_notes_df():
+    """Read every note in the vault into a DataFrame, tagging any new notes."""
+    output_rows, _, _ = _collect_notes({})
+    return pd.DataFrame(output_rows, columns=NOTE_COLUMNS)
+
+
+def make_changed_notes_df(manifest):
+    """
+    Read only the notes that are new or changed since the last ingest.
+
+    Args:
+        manifest: Ingest manifest (first item returned by load_manifest())
+
+    Returns:
+        Tuple of (notes_df, new_manifest, stats). stats counts 'added',
+        'changed', 'unchanged' and 'removed' notes. Save new_manifest with
+        save_manifest() once the notes have been upserted.
+    """
+    output_rows, new_manifest, stats = _collect_notes(manifest)
+    return pd.DataFrame(output_rows, columns=NOTE_COLUMNS), new_manifest, stats
@@ -0,0 +1,128 @@
+"""
+Persistent on-disk embedding cache for WorldWhisperer.
+Stores vectors as float16 SQLite BLOBs keyed by (embedding model, SHA-256 of text),
+so unchanged documents and repeated questions are never embedded twice, even
+across collections and ChromaDB paths.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Size-bounded SQLite cache of text embeddings with least-recently-used eviction."""
+
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: SQLite file (defaults to embedding_cache_path env var)
+            max_entries: Entries kept before LRU eviction (defaults to env var)
+        """
+        self.path = path or os.getenv('embedding_cache_path', './embedding_cache.db')
+        self.max_entries = max_entries or int(os.getenv('embedding_cache_max_entries', '200000'))
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            ' model TEXT NOT NULL,'
+            ' text_hash TEXT NOT NULL,'
+            ' vector BLOB NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' PRIMARY KEY (model, text_hash))'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._conn.commit()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            model: Embedding model name
+            texts: Texts to look up
+
+        Returns:
+            Dict mapping index in texts to its float32 vector, for cache hits only
+        """
+        hashes = [self._hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                chunk = list(set(hashes[start:start + 500]))
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})',
+                    [model, *chunk]
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                    [(now, model, text_hash) for text_hash in found]
+                )
+                self._conn.commit()
+
+        return {
+            i: np.frombuffer(found[text_hash], dtype=np.float16).astype(np.float32)
+            for i, text_hash in enumerate(hashes) if text_hash in found
+        }
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        """Store embeddings for texts, evicting the least recently used entries if over budget."""
+        now = time.time()
+        rows = [
+            (model, self._hash(text), np.asarray(vector, dtype=np.float16).tobytes(), now)
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)', rows)
+            excess = self._conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    'DELETE FROM embeddings WHERE rowid IN '
+                    '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+            self._conn.commit()
+
+    def clear(self):
+        """Remove every cached embedding."""
+        with self._lock:
+            self._conn.execute('DELETE FROM embeddings')
+            self._conn.commit()
+
+
+# Global cache instance (lazy-loaded)
+_global_cache: Optional[EmbeddingCache] = None
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """
+    Get the global embedding cache (creates if not exists).
+
+    Returns:
+        EmbeddingCache instance, or None if embedding_cache is disabled
+    """
+    global _global_cache
+    if os.getenv('embedding_cache', 'True') != 'True':
+        return None
+    if _global_cache is None:
+        _global_cache = EmbeddingCache()
+    return _global_cache
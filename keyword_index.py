@@ -0,0 +1,151 @@
+"""
+In-process BM25 keyword index for WorldWhisperer.
+Complements dense retrieval for exact proper nouns (NPC names, places, invented
+words like "Rift Key") that embeddings tend to blur. The index mirrors the
+ChromaDB entries, is updated incrementally at ingest time and is persisted as
+JSON next to the Chroma store.
+"""
+
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from persistence import CollectionRegistry, write_json_atomic
+
+# Unicode word characters, so "Zoë" and "café" stay whole; hyphens and
+# apostrophes split, so "Rift-Key" and "Kalinda's" match "Rift Key" and "Kalinda"
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens used for both indexing and querying."""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class KeywordIndex:
+    """Inverted index with BM25 scoring over ChromaDB entry IDs."""
+
+    def __init__(self, path: Path, k1: float = 1.5, b: float = 0.75):
+        """
+        Load the index from path if it exists.
+
+        Args:
+            path: JSON file holding the index
+            k1: BM25 term-frequency saturation
+            b: BM25 length normalization
+        """
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        # id -> {'parent': note title, 'length': token count, 'terms': {term: tf}}
+        self.docs: Dict[str, Dict] = {}
+        # term -> {id: tf}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+
+        if self.path.exists():
+            with self.path.open('r', encoding='utf-8') as f:
+                for doc_id, doc in json.load(f)['docs'].items():
+                    self._add_doc(doc_id, doc)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def _add_doc(self, doc_id: str, doc: Dict):
+        self.docs[doc_id] = doc
+        self.total_length += doc['length']
+        for term, tf in doc['terms'].items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+
+    def _remove_doc(self, doc_id: str):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_length -= doc['length']
+        for term in doc['terms']:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def add(self, ids: List[str], documents: List[str], parents: List[str]):
+        """Index (or re-index) entries."""
+        with self._lock:
+            for doc_id, document, parent in zip(ids, documents, parents):
+                self._remove_doc(doc_id)
+                terms = tokenize(document)
+                self._add_doc(doc_id, {'parent': parent, 'length': len(terms), 'terms': dict(Counter(terms))})
+
+    def remove_ids(self, ids: List[str]):
+        """Remove entries by ID."""
+        with self._lock:
+            for doc_id in ids:
+                self._remove_doc(doc_id)
+
+    def remove_parents(self, titles: List[str]):
+        """Remove every entry belonging to the given notes."""
+        titles = set(titles)
+        with self._lock:
+            for doc_id in [doc_id for doc_id, doc in self.docs.items() if doc['parent'] in titles]:
+                self._remove_doc(doc_id)
+
+    def search(self, query: str, n_results: int) -> List[Tuple[str, float]]:
+        """
+        Rank entries against query with BM25.
+
+        Returns:
+            Up to n_results (id, score) pairs, best first
+        """
+        with self._lock:
+            if not self.docs:
+                return []
+            n_docs = len(self.docs)
+            avg_length = self.total_length / n_docs
+
+            scores = Counter()
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    length = self.docs[doc_id]['length']
+                    norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+
+        return scores.most_common(n_results)
+
+    def save(self):
+        """Atomically write the index to disk."""
+        with self._lock:
+            write_json_atomic(self.path, {'docs': self.docs})
+
+
+# Shared index instances, one per (path, collection name)
+_indexes = CollectionRegistry(KeywordIndex, '_bm25.json')
+
+
+def get_index(collection_name: Optional[str] = None, chromadb_path: Optional[str] = None) -> KeywordIndex:
+    """
+    Get the keyword index for a collection (loaded on first use).
+
+    Args:
+        collection_name: Defaults to chromadb_collection_name env var
+        chromadb_path: Defaults to chromadb_path env var
+
+    Returns:
+        KeywordIndex instance
+    """
+    return _indexes.get(collection_name, chromadb_path)
+
+
+def reset_index(collection_name: Optional[str] = None, chromadb_path: Optional[str] = None):
+    """Delete a collection's keyword index so the next ingest starts from scratch."""
+    _indexes.reset(collection_name, chromadb_path)
@@ -1,16 +1,97 @@
 import os
-import tiktoken
+from functools import lru_cache
 from typing import Optional, Dict, List
 from openrouter_client import get_client
 
 
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base"):
+    """Get a tiktoken encoder, built once and reused across calls"""
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
 def count_tokens(string: str) -> int:
     """Count tokens in a string using tiktoken"""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    num_tokens = len(encoding.encode(string))
+    num_tokens = len(get_encoding().encode(string))
     return num_tokens
 
 
+@lru_cache(maxsize=None)
+def get_context_window(model: str) -> int:
+    """
+    Context window of a model in tokens.
+
+    Uses the model_context_window env var if set, otherwise the context_length
+    OpenRouter reports for the model (looked up once per model), falling back
+    to 8192.
+    """
+    override = os.getenv('model_context_window')
+    if override:
+        return int(override)
+    try:
+        for model_info in get_client().get_available_models():
+            if model_info['id'] == model and model_info.get('context_length'):
+                return int(model_info['context_length'])
+    except Exception as e:
+        print(f"Warning: could not look up context window for {model} ({e})")
+    return 8192
+
+
+def get_context_budget(model: str, fixed_prompt: str) -> int:
+    """
+    Tokens available for retrieved context in a prompt for model.
+
+    The model's context window minus the completion reserve
+    (completion_token_reserve) and the tokens of the fixed prompt text, capped
+    at context_token_limit to keep per-query cost predictable.
+    """
+    reserve = int(os.getenv('completion_token_reserve', '2048'))
+    limit = int(os.getenv('context_token_limit', '4000'))
+    available = get_context_window(model) - reserve - count_tokens(fixed_prompt)
+    return max(0, min(available, limit))
+
+
+def pack_context(entries: List[str], token_budget: int, separator: str = "\n\n---\n\n",
+                 min_partial_tokens: int = 32) -> str:
+    """
+    Join context entries, in order, into at most token_budget tokens.
+
+    Each entry is encoded once, so building the context is linear in its size.
+    The last entry that doesn't fit is truncated at a token boundary rather
+    than dropped, unless fewer than min_partial_tokens would be left of it.
+
+    Args:
+        entries: Context entries, most relevant first
+        token_budget: Maximum tokens for the joined context
+        separator: Text placed between entries
+        min_partial_tokens: Smallest useful partial entry
+
+    Returns:
+        The packed context string
+    """
+    encoding = get_encoding()
+    separator_tokens = len(encoding.encode(separator))
+
+    parts = []
+    used = 0
+    for entry in entries:
+        remaining = token_budget - used - (separator_tokens if parts else 0)
+        if remaining <= 0:
+            break
+
+        tokens = encoding.encode(entry)
+        if len(tokens) > remaining:
+            if remaining >= min_partial_tokens:
+                parts.append(encoding.decode(tokens[:remaining]))
+            break
+
+        parts.append(entry)
+        used += len(tokens) + (separator_tokens if len(parts) > 1 else 0)
+
+    return separator.join(parts)
+
+
 
 def call_openrouter(
     messages: List[Dict[str, str]],
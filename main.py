@@ -11,10 +11,9 @@ Integrated D&D/Pathfinder campaign management tool combining:
 import os
 from dotenv import load_dotenv
 
-# Core modules
-import data_code
-import llm_code
-import chromadb_code
+# Core modules (data_code, llm_code, chromadb_code) are imported where they are
+# first used: they pull in chromadb, sentence-transformers, torch and pandas,
+# which would otherwise delay the first menu by several seconds.
 
 # Pathfinder Tools modules
 import pathfinder_generator
@@ -25,7 +24,30 @@ import shop_calculator
 from menu_system import display_header, get_choice, confirm, pause
 
 
-def call_pine_gpt(admin_command=None, additional_context=None, prompt=None, mode='question'):
+def ask_category():
+    """
+    Optionally restrict retrieval to one note category (vault folder).
+
+    Returns:
+        ChromaDB where filter, or None to search every note
+    """
+    import data_code
+
+    categories = data_code.list_note_categories()
+    if not categories:
+        return None
+    answer = input(f"Limit to category ({', '.join(categories)}; blank for all): ").strip()
+    if not answer:
+        return None
+    for category in categories:
+        if category.lower() == answer.lower():
+            return {'category': category}
+    print(f"Unknown category '{answer}', searching all notes.")
+    return None
+
+
+def call_pine_gpt(admin_command=None, additional_context=None, prompt=None, mode='question', where=None,
+                  use_answer_cache=False):
     """
     Query ChromaDB and generate response.
 
@@ -34,23 +56,65 @@ def call_pine_gpt(admin_command=None, additional_context=None, prompt=None, mode
         additional_context: Additional user-provided context
         prompt: User's prompt/question
         mode: 'question' for Q&A, 'generator' for content creation
+        where: Optional metadata filter for retrieval, e.g. {'category': 'People'}
+        use_answer_cache: Reuse answers to near-identical earlier questions
+            (question mode only, see answer_cache.py)
     """
+    import time
+
+    import answer_cache
+    import chromadb_code
+    import llm_code
+
+    query = prompt + "\n" + additional_context
+
+    # Semantic answer cache: a near-identical earlier question skips retrieval and the LLM
+    cache = answer_cache.get_cache() if use_answer_cache and mode == 'question' else None
+    if cache:
+        start = time.perf_counter()
+        query_embedding = chromadb_code.create_embeddings([query])[0]
+        context_key = cache.context_key(
+            chromadb_code.embedding_model_key(),
+            os.getenv('openrouter_model', 'anthropic/claude-3.5-sonnet'),
+            admin_command,
+            where
+        )
+        hit = cache.lookup(query_embedding, context_key)
+        if hit:
+            print(f"Cached answer to \"{hit['query'].strip()}\" "
+                  f"(similarity {hit['similarity']:.3f}, {(time.perf_counter() - start) * 1000:.1f} ms)")
+            print("\n" + "="*70)
+            print(hit['answer'])
+            print("="*70)
+            return hit['answer']
+
     # Get context from ChromaDB with mode-specific formatting
     loaded_query, relevance_data = chromadb_code.get_chromadb_context(
-        prompt + "\n" + additional_context,
-        mode=mode
+        query,
+        mode=mode,
+        where=where
     )
+    timings = chromadb_code.last_retrieval_timings
+    if timings:
+        stages = ', '.join(
+            f"{stage} {timings[stage + '_ms']:.1f} ms"
+            for stage in ('title', 'vector', 'keyword', 'fusion', 'rerank', 'mmr') if stage + '_ms' in timings
+        )
+        print(f"Retrieval: {timings['total_ms']:.1f} ms ({stages})")
 
     # Use enhanced generation for Generator mode
     if mode == 'generator':
-        result = gpt_code.generate_with_feedback(
+        result = llm_code.generate_with_feedback(
             admin_command,
             loaded_query,
             prompt,
             relevance_data
         )
     else:
-        result = gpt_code.llm(admin_command, " ", loaded_query)
+        result = llm_code.llm(admin_command, " ", loaded_query)
+        # llm() reports failures as "Error: ..." answers, which must not be cached
+        if cache and not result.startswith("Error:"):
+            cache.put(query, query_embedding, context_key, result, [note['title'] for note in relevance_data])
 
     print("\n" + "="*70)
     print(result)
@@ -58,6 +122,45 @@ def call_pine_gpt(admin_command=None, additional_context=None, prompt=None, mode
     return result
 
 
+def call_pine_gpt_batch(admin_command, prompts, mode='question', where=None, max_concurrency=None):
+    """
+    Answer many lore prompts in one pass, e.g. from a session prep script.
+
+    Retrieval for all prompts shares one embedding call and one ChromaDB
+    query; the LLM calls then run concurrently.
+
+    Args:
+        admin_command: System instruction/role
+        prompts: List of prompts/questions
+        mode: 'question' for Q&A, 'generator' for content creation
+        where: Optional metadata filter for retrieval, e.g. {'category': 'People'}
+        max_concurrency: Maximum simultaneous LLM calls (defaults to llm_concurrency env var)
+
+    Returns:
+        List of responses, in the same order as prompts
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import chromadb_code
+    import llm_code
+
+    contexts = chromadb_code.get_chromadb_contexts(prompts, mode=mode, where=where)
+    timings = chromadb_code.last_retrieval_timings
+    if timings:
+        print(f"Retrieval for {len(prompts)} prompts: {timings['total_ms']:.1f} ms")
+
+    def answer(item):
+        prompt, (loaded_query, relevance_data) = item
+        if mode == 'generator':
+            return llm_code.generate_with_feedback(admin_command, loaded_query, prompt, relevance_data)
+        return llm_code.llm(admin_command, " ", loaded_query)
+
+    max_concurrency = max_concurrency or int(os.getenv('llm_concurrency', '4'))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        # map() yields results in input order
+        return list(executor.map(answer, zip(prompts, contexts)))
+
+
 def world_lore_menu():
     """World Lore Manager submenu."""
     while True:
@@ -85,11 +188,14 @@ def world_lore_menu():
         elif idx == 1:  # Questions
             print("\n" + "-"*70)
             prompt = input("Your Question: ")
+            where = ask_category()
             call_pine_gpt(
                 "You are a DnD dungeon master answering questions about your world.",
                 " ",
                 prompt,
-                mode='question'
+                mode='question',
+                where=where,
+                use_answer_cache=True
             )
             pause()
 
@@ -98,11 +204,13 @@ def world_lore_menu():
             print("Generator Mode creates new lore that integrates with your existing world.")
             print("Examples: 'Create a mysterious tavern', 'Generate a new NPC merchant'\n")
             prompt = input("Generation Prompt: ")
+            where = ask_category()
             call_pine_gpt(
                 "You are an expert DnD dungeon master creating rich, interconnected campaign world content.",
                 " ",
                 prompt,
-                mode='generator'
+                mode='generator',
+                where=where
             )
             pause()
 
@@ -137,8 +245,71 @@ def pathfinder_tools_menu():
             pathfinder_generator.dice_roller_interface()
 
 
+def update_chromadb():
+    """Re-index new/changed notes, previewing the counts before upserting."""
+    import chromadb_code
+    import data_code
+
+    print("\nUpdating Tags and Scanning for Changed Notes...")
+    fingerprint = chromadb_code.ingest_fingerprint()
+    manifest, stale = data_code.load_manifest(fingerprint)
+    if stale:
+        print("Embedding model, chunking or vector store settings changed: re-indexing every note")
+    lore_df, new_manifest, stats = data_code.make_changed_notes_df(manifest)
+    print("✓ Tags updated")
+    print(f"  Added: {stats['added']}  Changed: {stats['changed']}  "
+          f"Unchanged: {stats['unchanged']}  Removed: {stats['removed']}")
+
+    if lore_df.empty and not stats['removed'] and not stale:
+        data_code.save_manifest(new_manifest, fingerprint)
+        print("✓ ChromaDB already up to date")
+    elif confirm("Update ChromaDB now? (y/n): "):
+        if stale:
+            chromadb_code.reset_collection()
+        if not lore_df.empty:
+            chromadb_code.upsert_chromadb(lore_df)
+        if stats['removed']:
+            orphan_ids = chromadb_code.sync_chromadb(data_code.list_note_titles())
+            print(f"✓ Removed {len(orphan_ids)} deleted/renamed notes")
+        data_code.save_manifest(new_manifest, fingerprint)
+        chromadb_code.invalidate_collections()
+        print("✓ ChromaDB Updated")
+    else:
+        print("ChromaDB not updated")
+
+
+def stream_update_chromadb():
+    """Re-index new/changed notes through the streaming read/tag/embed/upsert pipeline."""
+    import chromadb_code
+    import data_code
+
+    print("\nStreaming new/changed notes into ChromaDB...")
+    fingerprint = chromadb_code.ingest_fingerprint()
+    manifest, stale = data_code.load_manifest(fingerprint)
+    if stale:
+        print("Embedding model, chunking or vector store settings changed: re-indexing every note")
+        chromadb_code.reset_collection()
+    new_manifest = {}
+    stats = {'added': 0, 'changed': 0, 'unchanged': 0, 'removed': 0}
+    batch_size = int(os.getenv('ingest_batch_size', '100'))
+
+    note_batches = data_code.iter_note_batches(manifest, new_manifest, stats, batch_size)
+    chromadb_code.stream_upsert_chromadb(note_batches)
+    print(f"  Added: {stats['added']}  Changed: {stats['changed']}  "
+          f"Unchanged: {stats['unchanged']}  Removed: {stats['removed']}")
+
+    if stats['removed']:
+        orphan_ids = chromadb_code.sync_chromadb(data_code.list_note_titles())
+        print(f"✓ Removed {len(orphan_ids)} deleted/renamed notes")
+    data_code.save_manifest(new_manifest, fingerprint)
+    chromadb_code.invalidate_collections()
+    print("✓ ChromaDB Updated")
+
+
 def settings_menu():
     """Settings and configuration menu."""
+    import chromadb_code
+
     while True:
         display_header("SETTINGS", "Main Menu > Settings")
 
@@ -149,10 +320,12 @@ def settings_menu():
         print(f"  Obsidian People: {os.getenv('obsidian_people_path', 'not set')}")
         print(f"  Party Level: {os.getenv('pathfinder_party_level', '3')}")
         print(f"  Party Size: {os.getenv('pathfinder_party_size', '3')}")
+        print(f"  Embedding Warm-up: {chromadb_code.get_warmup_status()}")
         print()
 
         options = [
-            "Update ChromaDB (re-index all lore)",
+            "Update ChromaDB (re-index new/changed lore)",
+            "Sync ChromaDB (remove deleted/renamed notes)",
             "View API key status",
             "View configuration file location"
         ]
@@ -163,18 +336,28 @@ def settings_menu():
             break
 
         if idx == 0:  # Update ChromaDB
-            print("\nUpdating Tags and Creating Lore Dataframe...")
-            lore_df = data_code.make_notes_df()
-            print("✓ Tags updated")
-
-            if confirm("Update ChromaDB now? (y/n): "):
-                chromadb_code.upsert_chromadb(lore_df)
-                print("✓ ChromaDB Updated")
+            if os.getenv('streaming_ingest', 'False') != 'True':
+                update_chromadb()
+            elif confirm("Stream new/changed notes into ChromaDB now? (y/n): "):
+                stream_update_chromadb()
             else:
                 print("ChromaDB not updated")
             pause()
 
-        elif idx == 1:  # API key status
+        elif idx == 1:  # Sync ChromaDB
+            import data_code
+
+            print("\nComparing Notes directory with ChromaDB...")
+            orphan_ids = chromadb_code.sync_chromadb(data_code.list_note_titles())
+            if orphan_ids:
+                for orphan_id in orphan_ids:
+                    print(f"  - {orphan_id}")
+                print(f"✓ Removed {len(orphan_ids)} deleted/renamed notes")
+            else:
+                print("✓ No orphaned entries found")
+            pause()
+
+        elif idx == 2:  # API key status
             api_key = os.getenv('openrouter_api_key')
             if api_key:
                 masked = api_key[:10] + "..." if len(api_key) > 10 else "***"
@@ -184,7 +367,7 @@ def settings_menu():
                 print("  Please add 'openrouter_api_key' to your .env file")
             pause()
 
-        elif idx == 2:  # Config file location
+        elif idx == 3:  # Config file location
             env_path = os.path.join(os.getcwd(), '.env')
             print(f"\nConfiguration file: {env_path}")
             print(f"Exists: {'✓ Yes' if os.path.exists(env_path) else '❌ No'}")
@@ -227,6 +410,11 @@ def initialize_system():
     """Initialize the system on startup."""
     load_dotenv()
 
+    if os.getenv('prewarm_embeddings', 'True') == 'True':
+        # Load the embedding model and open ChromaDB while the user navigates menus
+        import chromadb_code
+        chromadb_code.start_warmup()
+
     print("="*70)
     print(" WORLDWHISPERER - INITIALIZATION")
     print("="*70)
@@ -240,7 +428,7 @@ def initialize_system():
     if not os.path.exists(file_path):
         print("Creating tags.csv file...")
         with open(file_path, 'w') as file:
-            file.write('title, tags\n')
+            file.write('title,tags\n')
 
     # Check API key
     if not os.getenv('openrouter_api_key'):
@@ -256,11 +444,16 @@ def initialize_system():
     if not os.path.exists('chromadb') or not os.listdir('chromadb'):
         print("\n📊 ChromaDB is empty or not initialized.")
         if confirm("Initialize ChromaDB now? (y/n): "):
+            import chromadb_code
+            import data_code
+
             print("\nUpdating Tags and Creating Lore Dataframe...")
-            lore_df = data_code.make_notes_df()
+            lore_df, new_manifest, _ = data_code.make_changed_notes_df({})
             print("✓ Complete")
 
             chromadb_code.upsert_chromadb(lore_df)
+            data_code.save_manifest(new_manifest, chromadb_code.ingest_fingerprint())
+            chromadb_code.invalidate_collections()
             print("✓ ChromaDB Initialized")
     else:
         print("✓ ChromaDB database found")
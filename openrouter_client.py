@@ -1,12 +1,23 @@
 """
 Unified OpenRouter API client for WorldWhisperer.
 Centralizes all OpenRouter API calls with consistent error handling and configuration.
+Requests go through one pooled keep-alive session, and rate limits (429),
+server errors (5xx) and dropped connections are retried with exponential
+backoff.
 """
 
 import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Optional, Dict, List, Union
 
+# Status codes worth retrying: rate limited or a transient upstream failure
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
 
 class OpenRouterClient:
     """Client for making requests to the OpenRouter API."""
@@ -28,6 +39,60 @@ class OpenRouterClient:
         self.site_name = os.getenv('openrouter_site_name', 'WorldWhisperer')
         self.base_url = 'https://openrouter.ai/api/v1'
 
+        self.timeout = float(os.getenv('openrouter_timeout', '30'))
+        self.max_retries = int(os.getenv('openrouter_max_retries', '4'))
+        self.backoff_base = float(os.getenv('openrouter_backoff_base', '1.0'))
+        self.backoff_max = float(os.getenv('openrouter_backoff_max', '30'))
+
+        # One session reuses TCP/TLS connections across calls; the pool must
+        # hold a connection per concurrent caller (tagging workers, batch questions)
+        pool_size = int(os.getenv('openrouter_pool_size', '10'))
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'HTTP-Referer': self.site_url,
+            'X-Title': self.site_name,
+            'Content-Type': 'application/json'
+        })
+
+        # Timing of the last request made by each thread
+        self._local = threading.local()
+
+    @property
+    def last_request_timing(self) -> Optional[Dict]:
+        """
+        Timing of the calling thread's most recent request.
+
+        Returns:
+            Dict with 'endpoint', 'status' (None if no response), 'attempts',
+            'request_ms' (last attempt) and 'total_ms' (including retries and
+            backoff), or None before the first request
+        """
+        return getattr(self._local, 'timing', None)
+
+    def _backoff_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """
+        Seconds to wait before retry number attempt (1-based).
+
+        Uses the server's Retry-After header when present, otherwise
+        exponential backoff with full jitter.
+        """
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def close(self):
+        """Close pooled connections."""
+        self.session.close()
+
     def _make_request(
         self,
         endpoint: str,
@@ -46,28 +111,50 @@ class OpenRouterClient:
             API response as dictionary
 
         Raises:
-            Exception: If API request fails
+            Exception: If API request fails after all retries
         """
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'HTTP-Referer': self.site_url,
-            'X-Title': self.site_name,
-            'Content-Type': 'application/json'
-        }
-
-        url = f"{self.base_url}{endpoint}"
-
-        if method.upper() == 'GET':
-            response = requests.get(url, headers=headers, timeout=30)
-        elif method.upper() == 'POST':
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-        else:
+        method = method.upper()
+        if method not in ('GET', 'POST'):
             raise ValueError(f"Unsupported HTTP method: {method}")
 
-        if response.status_code != 200:
-            raise Exception(f"OpenRouter API error: {response.status_code} - {response.text}")
-
-        return response.json()
+        url = f"{self.base_url}{endpoint}"
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            error = None
+            attempt_start = time.perf_counter()
+            try:
+                response = self.session.request(
+                    method, url, json=payload if method == 'POST' else None, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A read timeout on POST may mean the completion is still running
+                # (and will be billed); only GETs are safe to resend after one
+                if method == 'POST' and isinstance(e, requests.ReadTimeout):
+                    raise Exception(f"OpenRouter API error: {e}") from e
+                error = e
+            now = time.perf_counter()
+            self._local.timing = {
+                'endpoint': endpoint,
+                'status': response.status_code if response is not None else None,
+                'attempts': attempt,
+                'request_ms': (now - attempt_start) * 1000,
+                'total_ms': (now - start) * 1000
+            }
+
+            if response is not None and response.status_code == 200:
+                return response.json()
+
+            retryable = error is not None or response.status_code in RETRY_STATUS_CODES
+            delay = self._backoff_delay(attempt, response) if retryable else None
+            # Give up rather than sleep past backoff_max (e.g. a long Retry-After)
+            if not retryable or attempt > self.max_retries or delay > self.backoff_max:
+                if error is not None:
+                    raise Exception(f"OpenRouter API error: {error}") from error
+                raise Exception(f"OpenRouter API error: {response.status_code} - {response.text}")
+            time.sleep(delay)
 
     def chat_completion(
         self,
@@ -164,6 +251,7 @@ class OpenRouterClient:
 
 # Global client instance (lazy-loaded)
 _global_client: Optional[OpenRouterClient] = None
+_global_client_lock = threading.Lock()
 
 
 def get_client() -> OpenRouterClient:
@@ -174,12 +262,17 @@ def get_client() -> OpenRouterClient:
         OpenRouterClient instance
     """
     global _global_client
-    if _global_client is None:
-        _global_client = OpenRouterClient()
-    return _global_client
+    # Tagging workers may all ask at once; build exactly one pooled session
+    with _global_client_lock:
+        if _global_client is None:
+            _global_client = OpenRouterClient()
+        return _global_client
 
 
 def reset_client():
     """Reset the global client instance (useful for testing or config changes)."""
     global _global_client
-    _global_client = None
\ No newline at end of file
+    with _global_client_lock:
+        if _global_client is not None:
+            _global_client.close()
+        _global_client = None
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Shared persistence helpers for WorldWhisperer.
+Atomic file writes for the JSON/CSV/NumPy files kept beside the Chroma store,
+and a registry of per-collection index instances (BM25 keywords, titles).
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+@contextmanager
+def atomic_open(path, mode: str = 'w', **open_kwargs):
+    """
+    Open a temporary file that replaces path when the block exits cleanly.
+
+    Readers never see a half-written file; if the block raises, path is left
+    untouched and the temporary file is removed.
+
+    Args:
+        path: Destination file (parent directories are created)
+        mode: 'w' or 'wb'
+        **open_kwargs: Passed to open(), e.g. encoding or newline
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    try:
+        with tmp_path.open(mode, **open_kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """Atomically write data to path as UTF-8 JSON."""
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **dump_kwargs)
+
+
+class CollectionRegistry(Generic[T]):
+    """
+    One shared instance per (chromadb path, collection name), loaded on first use.
+
+    Used for the indexes stored as <chromadb_path>/<collection><suffix>.
+    """
+
+    def __init__(self, factory: Callable[[Path], T], suffix: str):
+        """
+        Args:
+            factory: Builds an instance from its file path
+            suffix: File name suffix, e.g. '_bm25.json'
+        """
+        self.factory = factory
+        self.suffix = suffix
+        self._instances: Dict[Tuple[str, str], T] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(collection_name: Optional[str], chromadb_path: Optional[str]) -> Tuple[str, str]:
+        return (chromadb_path or os.getenv('chromadb_path', './chromadb'),
+                collection_name or os.getenv('chromadb_collection_name'))
+
+    def _file(self, key: Tuple[str, str]) -> Path:
+        chromadb_path, collection_name = key
+        return Path(chromadb_path) / f"{collection_name}{self.suffix}"
+
+    def get(self, collection_name: Optional[str] = None, chromadb_path: Optional[str] = None) -> T:
+        """
+        Get the instance for a collection (loaded on first use).
+
+        Args:
+            collection_name: Defaults to chromadb_collection_name env var
+            chromadb_path: Defaults to chromadb_path env var
+        """
+        key = self._key(collection_name, chromadb_path)
+        with self._lock:
+            if key not in self._instances:
+                self._instances[key] = self.factory(self._file(key))
+            return self._instances[key]
+
+    def reset(self, collection_name: Optional[str] = None, chromadb_path: Optional[str] = None):
+        """Delete a collection's file and forget its instance (e.g. before a full re-index)."""
+        key = self._key(collection_name, chromadb_path)
+        with self._lock:
+            self._instances.pop(key, None)
+            path = self._file(key)
+            if path.exists():
+                path.unlink()
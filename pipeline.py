@@ -0,0 +1,65 @@
+"""
+Small helpers for building streaming ingestion pipelines.
+Each stage runs on its own thread and hands results to the next stage through
+a bounded queue, so reading, tagging, embedding and writing overlap while
+memory stays bounded by the queue sizes.
+"""
+
+import os
+import queue
+import threading
+from itertools import islice
+
+_DONE = object()
+
+
+class _StageError:
+    """Wraps an exception raised inside a stage so it can be re-raised by the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+def batched(iterable, batch_size):
+    """Yield lists of up to batch_size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_stage(source, transform=None, maxsize=None):
+    """
+    Run a pipeline stage on a background thread.
+
+    Args:
+        source: Iterable feeding this stage (often the previous stage)
+        transform: Optional function applied to each item
+        maxsize: Queue bound (defaults to ingest_queue_size env var, 2)
+
+    Yields:
+        Items from source, passed through transform, in order
+    """
+    maxsize = maxsize or int(os.getenv('ingest_queue_size', '2'))
+    results = queue.Queue(maxsize=maxsize)
+
+    def worker():
+        try:
+            for item in source:
+                results.put(transform(item) if transform else item)
+        except BaseException as e:
+            results.put(_StageError(e))
+        finally:
+            results.put(_DONE)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    while True:
+        item = results.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
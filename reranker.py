@@ -0,0 +1,109 @@
+"""
+Optional cross-encoder reranking for WorldWhisperer.
+A cross-encoder reads the question and a note together, so its scores are much
+sharper than bi-encoder cosine similarity. The top candidates are scored in one
+batched forward pass on the CPU, and scores are kept in an LRU cache keyed by
+(question, note, note content hash) so repeated questions are free.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as cache key."""
+    return ' '.join(query.lower().split())
+
+
+class Reranker:
+    """CrossEncoder wrapper with an in-memory LRU score cache."""
+
+    def __init__(self, model_name: str, cache_size: Optional[int] = None):
+        """
+        Load the cross-encoder.
+
+        Args:
+            model_name: sentence-transformers CrossEncoder model
+            cache_size: Scores kept in the LRU cache (defaults to rerank_cache_size env var)
+        """
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        # Many rerankers (e.g. the ms-marco models) are configured to return raw
+        # logits; force a sigmoid so scores are in [0, 1] like cosine relevance
+        try:
+            self.model = CrossEncoder(model_name, device='cpu', activation_fn=torch.nn.Sigmoid())
+        except TypeError:
+            # sentence-transformers < 4 names the argument differently
+            self.model = CrossEncoder(model_name, device='cpu', default_activation_function=torch.nn.Sigmoid())
+        self.cache_size = cache_size or int(os.getenv('rerank_cache_size', '4096'))
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, query: str, notes: List[Dict]) -> List[float]:
+        """
+        Score notes against query.
+
+        Args:
+            query: User query
+            notes: Dicts with 'title' and 'text'
+
+        Returns:
+            Relevance score in [0, 1] for each note, in input order
+        """
+        query_key = normalize_query(query)
+        keys = [
+            (query_key, note['title'], hashlib.sha256(note['text'].encode('utf-8')).hexdigest())
+            for note in notes
+        ]
+
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        if missing:
+            pairs = [(query, f"{notes[i]['title']}: {notes[i]['text']}") for i in missing]
+            # One batched forward pass over every uncached pair
+            predicted = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            with self._lock:
+                for i, value in zip(missing, predicted):
+                    scores[keys[i]] = self._cache[keys[i]] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [scores[key] for key in keys]
+
+
+# Global reranker instance (lazy-loaded)
+_global_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker(verbose: bool = True) -> Optional[Reranker]:
+    """
+    Get the global reranker (loads the model on first use).
+
+    Args:
+        verbose: Announce the model load (off for background warm-up)
+
+    Returns:
+        Reranker instance, or None if reranker_model is not set
+    """
+    global _global_reranker
+    model_name = os.getenv('reranker_model', '')
+    if not model_name:
+        return None
+    with _reranker_lock:
+        if _global_reranker is None or _global_reranker.model_name != model_name:
+            if verbose:
+                print(f"Loading reranker model: {model_name}")
+            _global_reranker = Reranker(model_name)
+        return _global_reranker
@@ -25,7 +25,7 @@ def test_environment():
         'openrouter_model',
         'local_embed_model',
         'top_k',
-        'chromadb_context_limit'
+        'context_token_limit'
     ]
 
     print("\n✓ Checking required variables:")
@@ -202,6 +202,218 @@ def test_chromadb():
         return False
 
 
+def test_startup_import_time():
+    """Test that importing main.py stays fast and skips the heavy dependencies"""
+    print("\n" + "=" * 60)
+    print("TEST 6: Startup Import Time")
+    print("=" * 60 + "\n")
+
+    import subprocess
+    import sys
+
+    heavy_modules = ['chromadb', 'sentence_transformers', 'torch', 'pandas', 'tiktoken']
+    budget_ms = 1000
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+    try:
+        # -X importtime writes "import time: self [us] | cumulative | imported package" to stderr
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import sys, main; print(",".join(sorted(sys.modules)))'],
+            cwd=repo_dir, capture_output=True, text=True, timeout=60
+        )
+        if result.returncode != 0:
+            print(f"  ❌ Importing main failed:\n{result.stderr[-500:]}")
+            return False
+
+        # A module's nested imports are listed before it, so main's direct
+        # imports are the depth-1 lines since the previous top-level import.
+        # Other top-level entries (os, certifi, ...) load at interpreter startup.
+        direct, children = [], []
+        main_us = main_modules = 0
+        modules_since_top = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            _, cumulative_us, name = line[len('import time:'):].split('|')
+            # Nested imports are indented by two extra spaces per level
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            modules_since_top += 1
+            if depth == 1:
+                children.append((int(cumulative_us), name.strip()))
+            elif depth == 0:
+                if name.strip() == 'main':
+                    direct, main_us, main_modules = children, int(cumulative_us), modules_since_top
+                children, modules_since_top = [], 0
+
+        total_ms = main_us / 1000
+        print(f"  Total import time: {total_ms:.0f} ms ({main_modules} modules)")
+        print("  Slowest imports made by main.py:")
+        for cumulative_us, name in sorted(direct, reverse=True)[:5]:
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+        loaded = set(result.stdout.strip().split(','))
+        eager = [module for module in heavy_modules if module in loaded]
+        if eager:
+            print(f"  ❌ Heavy modules imported at startup: {', '.join(eager)}")
+            return False
+        print("  ✅ No heavy modules imported at startup")
+
+        if total_ms > budget_ms:
+            print(f"  ❌ Startup imports exceed {budget_ms} ms budget")
+            return False
+        print(f"  ✅ Startup imports within {budget_ms} ms budget")
+        return True
+
+    except Exception as e:
+        print(f"  ❌ Error: {e}")
+        return False
+
+
+def test_embedding_backend_parity():
+    """Test that the selected embedding backend ranks notes like the PyTorch model"""
+    print("\n" + "=" * 60)
+    print("TEST 7: Embedding Backend Parity")
+    print("=" * 60 + "\n")
+
+    try:
+        import time
+        from pathlib import Path
+
+        import numpy as np
+        import chromadb_code
+
+        backend = chromadb_code.get_embed_backend()
+        if backend == 'torch':
+            print("  ⚠️  embed_backend is 'torch', nothing to compare (set it to 'onnx' or 'int8')")
+            return True
+
+        tolerance = float(os.getenv('embed_parity_tolerance', '0.02'))
+
+        # Compare on the real corpus when there is one, otherwise the sample notes
+        notes_dir = Path('Notes') if any(Path('Notes').glob('*/*.md')) else Path('SampleNotes')
+        documents = [path.read_text(encoding='utf-8') for path in sorted(notes_dir.glob('*/*.md'))[:200]]
+        queries = [path.stem for path in sorted(notes_dir.glob('*/*.md'))[:20]]
+        print(f"  Corpus: {len(documents)} notes from {notes_dir}/")
+
+        results = {}
+        for name in ('torch', backend):
+            model = chromadb_code.build_embedding_model(name)
+            doc_vectors = model.encode(documents, normalize_embeddings=True, show_progress_bar=False)
+            start = time.perf_counter()
+            query_vectors = model.encode(queries, batch_size=1, normalize_embeddings=True, show_progress_bar=False)
+            query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            results[name] = (query_vectors @ doc_vectors.T, query_ms)
+            print(f"  {name:>5}: {query_ms:.1f} ms per query embedding")
+
+        max_diff = float(np.abs(results['torch'][0] - results[backend][0]).max())
+        print(f"\n  Max cosine similarity difference: {max_diff:.4f} (tolerance {tolerance})")
+        if max_diff > tolerance:
+            print(f"  ❌ '{backend}' backend is outside tolerance")
+            return False
+        print(f"  ✅ '{backend}' backend matches the PyTorch model")
+        return True
+
+    except Exception as e:
+        print(f"  ❌ Error: {e}")
+        return False
+
+
+def test_vector_store_benchmark():
+    """Benchmark the NumPy vector store against ChromaDB (cold start and query latency)"""
+    print("\n" + "=" * 60)
+    print("TEST 8: Vector Store Benchmark")
+    print("=" * 60 + "\n")
+
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    try:
+        import numpy as np
+        import chromadb
+        import vector_store
+
+        n_vectors = int(os.getenv('benchmark_vectors', '5000'))
+        n_queries = 200
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((n_vectors, 384)).astype(np.float32)
+        queries = rng.standard_normal((n_queries, 384)).astype(np.float32)
+        ids = [f"note-{i}" for i in range(n_vectors)]
+        metadatas = [{'title': id, 'category': ('People', 'Places')[i % 2]} for i, id in enumerate(ids)]
+        documents = ids
+        print(f"  Corpus: {n_vectors} random 384-d vectors, {n_queries} queries")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Build both stores
+            client = chromadb.PersistentClient(path=os.path.join(tmp_dir, 'chroma'))
+            stores = {
+                'chroma': vector_store.ChromaStore(client, client.get_or_create_collection(
+                    name='benchmark', metadata={"hnsw:space": "cosine"})),
+                'numpy': vector_store.NumpyStore(os.path.join(tmp_dir, 'numpy')),
+            }
+            for store in stores.values():
+                batch_size = store.max_batch_size()
+                for i in range(0, n_vectors, batch_size):
+                    store.upsert(ids[i:i + batch_size], vectors[i:i + batch_size],
+                                 metadatas[i:i + batch_size], documents[i:i + batch_size])
+                store.flush()
+
+            # Cold start: fresh interpreter, open the store and answer one query
+            open_code = {
+                'chroma': ("import chromadb; client = chromadb.PersistentClient(path=PATH); "
+                           "store = vector_store.ChromaStore(client, client.get_collection(name='benchmark'))"),
+                'numpy': "store = vector_store.NumpyStore(PATH)",
+            }
+            top_ids = {}
+            print(f"\n  {'backend':>8} {'cold start':>11} {'p50':>9} {'p99':>9}")
+            for name, store in stores.items():
+                script = (
+                    "import time; start = time.perf_counter()\n"
+                    f"import vector_store; PATH = {os.path.join(tmp_dir, name)!r}\n"
+                    f"{open_code[name]}\n"
+                    f"store.query(query_embeddings=[[0.1] * 384], n_results=10)\n"
+                    "print((time.perf_counter() - start) * 1000)"
+                )
+                result = subprocess.run([sys.executable, '-c', script], cwd=repo_dir,
+                                        capture_output=True, text=True, timeout=300)
+                if result.returncode != 0:
+                    print(f"  ❌ {name} cold start failed:\n{result.stderr[-500:]}")
+                    return False
+                cold_ms = float(result.stdout.strip().splitlines()[-1])
+
+                latencies = []
+                top_ids[name] = []
+                for query in queries:
+                    start = time.perf_counter()
+                    found = store.query(query_embeddings=[query.tolist()], n_results=10,
+                                        include=['metadatas', 'distances'])
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    top_ids[name].append(found['ids'][0])
+                p50, p99 = np.percentile(latencies, [50, 99])
+                print(f"  {name:>8} {cold_ms:>8.0f} ms {p50:>6.2f} ms {p99:>6.2f} ms")
+
+        # Exact top-10 by brute force; random vectors are a hard case for HNSW, so its recall is informational
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        exact = [[ids[i] for i in np.argsort(-(normalized @ query))[:10]] for query in queries]
+        for name in stores:
+            recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(top_ids[name], exact)])
+            print(f"  {name:>8} top-10 recall: {recall:.1%}")
+
+        if top_ids['numpy'] != exact:
+            print("  ❌ NumPy store results differ from exact search")
+            return False
+        print("  ✅ NumPy store returns the exact nearest neighbours")
+        return True
+
+    except Exception as e:
+        print(f"  ❌ Error: {e}")
+        return False
+
+
 def main():
     """Run all tests"""
     print("\n" + "=" * 60)
@@ -215,7 +427,10 @@ def main():
         ("Package Imports", test_imports),
         ("Local Embedding Model", test_local_embedding),
         ("OpenRouter API Connection", test_openrouter_connection),
-        ("ChromaDB Initialization", test_chromadb)
+        ("ChromaDB Initialization", test_chromadb),
+        ("Startup Import Time", test_startup_import_time),
+        ("Embedding Backend Parity", test_embedding_backend_parity),
+        ("Vector Store Benchmark", test_vector_store_benchmark)
     ]
 
     results = {}
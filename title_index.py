@@ -0,0 +1,179 @@
+"""
+Exact-title matcher for WorldWhisperer.
+An Aho-Corasick automaton over every note title and frontmatter alias finds all
+notes named in a query in one linear pass, so questions like "What is the
+Solarium of Whispers?" always retrieve that note. Titles and aliases are
+recorded at ingest time and persisted as JSON next to the Chroma store.
+"""
+
+import json
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from persistence import CollectionRegistry, write_json_atomic
+
+
+class TitleMatcher:
+    """Aho-Corasick automaton mapping case-insensitive names to note titles."""
+
+    def __init__(self, names: Dict[str, str]):
+        """
+        Build the automaton.
+
+        Args:
+            names: Dict mapping each title or alias to the note title it names
+        """
+        # Trie as parallel lists: goto transitions, failure links, matched names
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str]]] = [[]]
+
+        for name, title in names.items():
+            pattern = name.lower().strip()
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append((len(pattern), title))
+
+        # Breadth-first pass to fill in failure links
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> List[str]:
+        """
+        Find every title named in text.
+
+        Matches must start and end on word boundaries, and a match inside a
+        longer one (e.g. an alias "Solarium" within "The Solarium of Whispers")
+        is ignored.
+
+        Returns:
+            Matched note titles in order of first appearance, without duplicates
+        """
+        text = text.lower()
+        spans = []
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, title in self._output[state]:
+                start = end - length
+                if _is_boundary(text, start - 1) and _is_boundary(text, end):
+                    spans.append((start, end, title))
+
+        # Longest match first at each start, then drop spans covered by an earlier one
+        spans.sort(key=lambda span: (span[0], -span[1]))
+        titles = []
+        covered_until = 0
+        for start, end, title in spans:
+            if end <= covered_until:
+                continue
+            covered_until = max(covered_until, end)
+            if title not in titles:
+                titles.append(title)
+        return titles
+
+
+def frontmatter_aliases(frontmatter: Dict) -> List[str]:
+    """Aliases listed in a note's parsed frontmatter ('aliases' or 'alias')."""
+    aliases = frontmatter.get('aliases', frontmatter.get('alias', []))
+    return [aliases] if isinstance(aliases, str) else list(aliases)
+
+
+def _is_boundary(text: str, index: int) -> bool:
+    """True if text[index] is outside the text or not a word character."""
+    return index < 0 or index >= len(text) or not text[index].isalnum()
+
+
+class TitleIndex:
+    """Persisted note titles and aliases with a lazily rebuilt matcher."""
+
+    def __init__(self, path: Path):
+        """Load the index from path if it exists."""
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._matcher: Optional[TitleMatcher] = None
+
+        # title -> list of aliases
+        self.aliases: Dict[str, List[str]] = {}
+        if self.path.exists():
+            with self.path.open('r', encoding='utf-8') as f:
+                self.aliases = json.load(f)['aliases']
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def __contains__(self, title: str) -> bool:
+        return title in self.aliases
+
+    def update(self, aliases: Dict[str, List[str]]):
+        """Add or replace notes, given as a dict of title -> aliases."""
+        with self._lock:
+            self.aliases.update(aliases)
+            self._matcher = None
+
+    def remove(self, titles: List[str]):
+        """Forget the given notes."""
+        with self._lock:
+            for title in titles:
+                self.aliases.pop(title, None)
+            self._matcher = None
+
+    def match(self, query: str) -> List[str]:
+        """Titles of the notes named in query, in order of appearance."""
+        with self._lock:
+            if self._matcher is None:
+                names = {}
+                for title, aliases in self.aliases.items():
+                    names.update((alias, title) for alias in aliases)
+                # Titles win over another note's identical alias
+                names.update((title, title) for title in self.aliases)
+                self._matcher = TitleMatcher(names)
+            matcher = self._matcher
+        return matcher.find(query)
+
+    def save(self):
+        """Atomically write the index to disk."""
+        with self._lock:
+            write_json_atomic(self.path, {'aliases': self.aliases})
+
+
+# Shared index instances, one per (path, collection name)
+_indexes = CollectionRegistry(TitleIndex, '_titles.json')
+
+
+def get_index(collection_name: Optional[str] = None, chromadb_path: Optional[str] = None) -> TitleIndex:
+    """
+    Get the title index for a collection (loaded on first use).
+
+    Args:
+        collection_name: Defaults to chromadb_collection_name env var
+        chromadb_path: Defaults to chromadb_path env var
+
+    Returns:
+        TitleIndex instance
+    """
+    return _indexes.get(collection_name, chromadb_path)
+
+
+def reset_index(collection_name: Optional[str] = None, chromadb_path: Optional[str] = None):
+    """Delete a collection's title index so the next ingest starts from scratch."""
+    _indexes.reset(collection_name, chromadb_path)
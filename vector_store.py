@@ -0,0 +1,304 @@
+"""
+Vector store backends for WorldWhisperer.
+Ingestion and retrieval talk to a VectorStore, which exposes the subset of the
+ChromaDB collection API they use (upsert, delete, get, query, count) with the
+same argument names and result shapes. Two backends are available:
+
+    chroma: ChromaDB PersistentClient collection with an HNSW index (default)
+    numpy:  Brute-force search over normalized embeddings kept in a
+            memory-mapped .npy file with a JSON sidecar of IDs, metadata and
+            documents. No index to load or maintain, which is faster for
+            vaults of a few thousand notes.
+"""
+
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from persistence import atomic_open, write_json_atomic
+
+VECTOR_STORES = ('chroma', 'numpy')
+
+
+def get_vector_store_backend():
+    """Vector store backend selected by the vector_store env var."""
+    backend = os.getenv('vector_store', 'chroma').lower()
+    if backend not in VECTOR_STORES:
+        raise ValueError(f"Unknown vector_store '{backend}'. Choose one of: {', '.join(VECTOR_STORES)}")
+    return backend
+
+
+class VectorStore(ABC):
+    """
+    Interface shared by the vector store backends.
+
+    Methods take and return the same shapes as the ChromaDB collection
+    methods of the same name, so callers don't need to know the backend.
+    A backend missing one of the abstract methods can't be instantiated.
+    """
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings, metadatas: List[Dict], documents: List[str]):
+        """Insert or replace entries."""
+
+    @abstractmethod
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Delete entries by ID and/or metadata filter (at least one is required)."""
+
+    @abstractmethod
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, include=('metadatas', 'documents')):
+        """Fetch entries. Returns a dict with 'ids' plus each included field, as flat lists."""
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include=('metadatas', 'documents', 'distances')):
+        """Nearest neighbours by cosine distance. Returns a dict of lists, one list per query."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored entries."""
+
+    @abstractmethod
+    def max_batch_size(self) -> int:
+        """Largest number of entries accepted by one upsert or delete call."""
+
+    def flush(self):
+        """Persist pending writes (called once at the end of an ingest)."""
+
+
+class ChromaStore(VectorStore):
+    """ChromaDB collection backend."""
+
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.collection.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+    def delete(self, ids=None, where=None):
+        self.collection.delete(ids=ids, where=where)
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents')):
+        return self.collection.get(ids=ids, where=where, include=list(include))
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('metadatas', 'documents', 'distances')):
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=list(include)
+        )
+
+    def count(self):
+        return self.collection.count()
+
+    def max_batch_size(self):
+        return self.client.get_max_batch_size()
+
+
+def matches_where(metadata: Dict, where: Optional[Dict]) -> bool:
+    """
+    Evaluate a ChromaDB-style metadata filter against one metadata dict.
+
+    Supports field equality, $eq, $ne, $in, $nin, $gt, $gte, $lt, $lte,
+    $and and $or.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for op, operand in condition.items():
+                if op == '$eq' and value != operand:
+                    return False
+                if op == '$ne' and value == operand:
+                    return False
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$nin' and value in operand:
+                    return False
+                if op in ('$gt', '$gte', '$lt', '$lte'):
+                    if value is None:
+                        return False
+                    if ((op == '$gt' and not value > operand) or (op == '$gte' and not value >= operand)
+                            or (op == '$lt' and not value < operand) or (op == '$lte' and not value <= operand)):
+                        return False
+    return True
+
+
+class NumpyStore(VectorStore):
+    """
+    Flat, memory-mapped vector store.
+
+    Embeddings are L2-normalized and stored row by row in vectors.npy; a JSON
+    sidecar (entries.json) holds the ID, metadata and document of each row.
+    On open, vectors.npy is memory-mapped, so start-up cost doesn't grow with
+    the vault. A query is one matrix product against every row.
+
+    Writes are kept in memory until flush(). New rows are appended to a list
+    and deleted or replaced rows are only marked, so an ingest of many batches
+    doesn't copy the whole matrix per batch; the matrix is rebuilt once, when
+    it is next queried or flushed.
+    """
+
+    def __init__(self, path: Path, dtype: Optional[str] = None):
+        """
+        Open the store at path (a directory), or start an empty one.
+
+        Args:
+            path: Directory holding vectors.npy and entries.json
+            dtype: Storage dtype, 'float32' or 'float16'
+                (defaults to vector_store_dtype env var)
+        """
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype or os.getenv('vector_store_dtype', 'float32'))
+        self._lock = threading.RLock()
+
+        entries_path = self.path / 'entries.json'
+        if entries_path.exists():
+            with entries_path.open('r', encoding='utf-8') as f:
+                entries = json.load(f)
+            self.vectors = np.load(self.path / 'vectors.npy', mmap_mode='r')
+        else:
+            entries = {'ids': [], 'metadatas': [], 'documents': []}
+            self.vectors = None
+        # Row-aligned entries; rows past len(self.vectors) are pending in _new_vectors
+        self.ids: List[str] = entries['ids']
+        self.metadatas: List[Dict] = entries['metadatas']
+        self.documents: List[str] = entries['documents']
+        self._new_vectors: List[np.ndarray] = []
+        self._deleted = set()
+        self._rows = {id: row for row, id in enumerate(self.ids)}
+
+    @staticmethod
+    def exists(path: Path) -> bool:
+        """True if a store has been written at path."""
+        return (Path(path) / 'entries.json').exists()
+
+    def _normalize(self, embeddings) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+    def _compact(self):
+        """Append pending rows and drop deleted ones, in one copy of the matrix."""
+        if not self._new_vectors and not self._deleted:
+            return
+        parts = [self.vectors] if self.vectors is not None and len(self.vectors) else []
+        if self._new_vectors:
+            parts.append(np.asarray(self._new_vectors, dtype=self.dtype))
+        keep = [row for row in range(len(self.ids)) if row not in self._deleted]
+        if parts:
+            vectors = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            self.vectors = np.asarray(vectors[keep], dtype=self.dtype)
+        self.ids = [self.ids[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self._rows = {id: row for row, id in enumerate(self.ids)}
+        self._new_vectors = []
+        self._deleted = set()
+
+    def _select_rows(self, ids=None, where=None) -> List[int]:
+        if ids is not None:
+            rows = [self._rows[id] for id in ids if id in self._rows]
+        else:
+            rows = [row for row in range(len(self.ids)) if row not in self._deleted]
+        return [row for row in rows if matches_where(self.metadatas[row], where)]
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        vectors = self._normalize(embeddings).astype(self.dtype)
+        with self._lock:
+            for id, vector, metadata, document in zip(ids, vectors, metadatas, documents):
+                # A replaced entry is marked deleted and re-appended
+                old_row = self._rows.get(id)
+                if old_row is not None:
+                    self._deleted.add(old_row)
+                self._rows[id] = len(self.ids)
+                self.ids.append(id)
+                self.metadatas.append(metadata)
+                self.documents.append(document)
+                self._new_vectors.append(vector)
+
+    def delete(self, ids=None, where=None):
+        if ids is None and where is None:
+            raise ValueError("delete() needs ids and/or a where filter")
+        with self._lock:
+            for row in self._select_rows(ids, where):
+                self._deleted.add(row)
+                self._rows.pop(self.ids[row], None)
+
+    def get(self, ids=None, where=None, include=('metadatas', 'documents')):
+        with self._lock:
+            if 'embeddings' in include:
+                self._compact()
+            rows = self._select_rows(ids, where)
+            result = {'ids': [self.ids[row] for row in rows]}
+            if 'metadatas' in include:
+                result['metadatas'] = [self.metadatas[row] for row in rows]
+            if 'documents' in include:
+                result['documents'] = [self.documents[row] for row in rows]
+            if 'embeddings' in include:
+                result['embeddings'] = np.asarray(self.vectors[rows], dtype=np.float32) if rows else []
+        return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=('metadatas', 'documents', 'distances')):
+        queries = self._normalize(query_embeddings)
+        result = {'ids': [], 'metadatas': [], 'documents': [], 'distances': [], 'embeddings': []}
+        with self._lock:
+            self._compact()
+            rows = np.asarray(self._select_rows(where=where) if where else range(len(self.ids)), dtype=np.int64)
+            if self.vectors is None or not len(rows):
+                candidates = np.empty((0, queries.shape[1]), dtype=np.float32)
+            elif len(rows) == len(self.ids):
+                candidates = self.vectors
+            else:
+                candidates = self.vectors[rows]
+
+            # One matrix product scores every row against every query
+            similarities = queries @ np.asarray(candidates, dtype=np.float32).T
+            n = min(n_results, len(rows))
+            for scores in similarities:
+                top = np.argpartition(-scores, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+                top = top[np.argsort(-scores[top], kind='stable')]
+                picked = rows[top]
+                result['ids'].append([self.ids[row] for row in picked])
+                result['metadatas'].append([self.metadatas[row] for row in picked])
+                result['documents'].append([self.documents[row] for row in picked])
+                result['distances'].append((1 - scores[top]).tolist())
+                result['embeddings'].append(np.asarray(candidates[top], dtype=np.float32))
+
+        for field in ('metadatas', 'documents', 'distances', 'embeddings'):
+            if field not in include:
+                result[field] = None
+        return result
+
+    def count(self):
+        return len(self._rows)
+
+    def max_batch_size(self):
+        return 100000
+
+    def flush(self):
+        """Write vectors.npy and entries.json atomically, then re-open the memory map."""
+        with self._lock:
+            self._compact()
+            # Drop the memory map before replacing the file underneath it
+            self.vectors = np.array(self.vectors if self.vectors is not None else np.empty((0, 0)), dtype=self.dtype)
+            with atomic_open(self.path / 'vectors.npy', 'wb') as f:
+                np.save(f, self.vectors)
+            write_json_atomic(self.path / 'entries.json',
+                              {'ids': self.ids, 'metadatas': self.metadatas, 'documents': self.documents})
+            self.vectors = np.load(self.path / 'vectors.npy', mmap_mode='r')